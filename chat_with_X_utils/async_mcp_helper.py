@@ -11,27 +11,32 @@ class MCPManager:
         self._sessions = {}
         self._tasks = {}
         self._tools = {}
+        self._stop_events = {}
 
-    async def _session_runner(self, name, ready_event):
+    async def _session_runner(self, name, ready_event, stop_event):
         async with self.client.session(name) as session:
             self._sessions[name] = session
             self._tools[name] = await load_mcp_tools(session)
             ready_event.set()
-            await asyncio.Future()  # keep alive
+            await stop_event.wait()  # keep alive until stop_session
 
     async def start_session(self, name: str):
         if name in self._tasks:
             raise RuntimeError(f"Session {name!r} already running")
         ready_event = asyncio.Event()
-        task = asyncio.create_task(self._session_runner(name, ready_event))
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(self._session_runner(name, ready_event, stop_event))
         self._tasks[name] = task
+        self._stop_events[name] = stop_event
         await ready_event.wait()
         return self._sessions[name], self._tools[name]
 
     async def stop_session(self, name: str):
         task = self._tasks.pop(name, None)
+        stop_event = self._stop_events.pop(name, None)
         if task:
-            task.cancel()
+            # Let the session context exit normally instead of cancelling the task
+            stop_event.set()
             try:
                 await task
             except asyncio.CancelledError:
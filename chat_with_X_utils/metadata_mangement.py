@@ -1,3 +1,4 @@
+import atexit
 import json
 import os
 import tempfile
@@ -5,19 +6,47 @@ from typing import Dict, Callable, Tuple, Any
 import threading
 import fcntl
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # In-process lock (threads / async tasks in same interpreter)
 _INPROCESS_METADATA_LOCK = threading.Lock()
+# Lock file descriptors kept open for the life of the process, keyed by lock path
+_LOCK_FDS: Dict[str, int] = {}
+
+def _get_lock_fd(lock_path: str) -> int:
+    """Return a cached fd for lock_path, opening it on first use (caller holds the in-process lock)."""
+    fd = _LOCK_FDS.get(lock_path)
+    if fd is None:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        _LOCK_FDS[lock_path] = fd
+    return fd
+
+@atexit.register
+def _close_lock_fds():
+    for fd in _LOCK_FDS.values():
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    _LOCK_FDS.clear()
+
+# A forked child must open its own lock fds: flock locks belong to the open file description,
+# so an inherited fd would share the parent's lock instead of waiting for it
+os.register_at_fork(after_in_child=_close_lock_fds)
 
-def _acquire_file_lock(fp):
+def _acquire_file_lock(fd: int):
     """Acquire an OS-level advisory lock on an open file descriptor (POSIX)."""
     try:
-        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        fcntl.flock(fd, fcntl.LOCK_EX)
     except Exception:
         pass
 
-def _release_file_lock(fp):
+def _release_file_lock(fd: int):
     try:
-        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        fcntl.flock(fd, fcntl.LOCK_UN)
     except Exception:
         pass
 
@@ -29,8 +58,9 @@ def load_metadata(metadata_file: str) -> Dict:
     `atomic_update_metadata` to avoid lost updates.
     """
     try:
-        with open(metadata_file, 'r') as f:
-            return json.load(f)
+        with open(metadata_file, 'rb') as f:
+            data = f.read()
+        return orjson.loads(data) if orjson else json.loads(data)
     except Exception:
         return {}
 
@@ -38,8 +68,12 @@ def save_metadata(metadata: Dict, save_file: str):
     """Persist document metadata to file atomically (best effort)."""
     directory = os.path.dirname(save_file) or "."
     os.makedirs(directory, exist_ok=True)
-    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as tmp:
-        json.dump(metadata, tmp, indent=2)
+    if orjson:
+        data = orjson.dumps(metadata, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        data = json.dumps(metadata, indent=2).encode()
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as tmp:
+        tmp.write(data)
         tmp.flush()
         os.fsync(tmp.fileno()) if hasattr(os, 'fsync') else None
         temp_name = tmp.name
@@ -59,16 +93,14 @@ def atomic_update_metadata(metadata_file: str, update_fn: Callable[[Dict], Tuple
     """
     directory = os.path.dirname(metadata_file) or "."
     os.makedirs(directory, exist_ok=True)
-    # Open file (create if missing) for locking
     with _INPROCESS_METADATA_LOCK:
         # Use separate lock file to avoid interfering with atomic rename pattern
-        lock_path = metadata_file + ".lock"
-        with open(lock_path, 'a+') as lock_fp:
-            _acquire_file_lock(lock_fp)
-            try:
-                current = load_metadata(metadata_file)
-                updated, result = update_fn(current)
-                save_metadata(updated, metadata_file)
-            finally:
-                _release_file_lock(lock_fp)
+        lock_fd = _get_lock_fd(metadata_file + ".lock")
+        _acquire_file_lock(lock_fd)
+        try:
+            current = load_metadata(metadata_file)
+            updated, result = update_fn(current)
+            save_metadata(updated, metadata_file)
+        finally:
+            _release_file_lock(lock_fd)
     return result
@@ -1,10 +1,16 @@
 """
 Printing utilities for LangGraph streaming and state outputs.
 """
+from collections import OrderedDict
 from typing import Set, Dict, Any
 from langchain_core.messages import ToolMessage
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 try:
     from rich.console import Console
     from rich.panel import Panel
@@ -14,28 +20,71 @@ except ImportError:
 
 console = Console() if Console else None
 
+# Formatted content per message, keyed by id(message). The message itself is kept in
+# the entry so its id cannot be reused while cached.
+_FORMAT_CACHE: "OrderedDict[int, tuple[Any, int, str]]" = OrderedDict()
+_FORMAT_CACHE_SIZE = 256
+
+
+def _dumps_args(args) -> str:
+    """Pretty-print tool call args as JSON, using orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(args, option=orjson.OPT_INDENT_2).decode()
+        except TypeError:
+            pass
+    return json.dumps(args, indent=2, ensure_ascii=False)
 
-def _format_message_content_rich_like(message) -> str:
-    """Format a LangChain message similar to notebooks/utils.py."""
-    parts = []
+
+def _format_message_content_rich_like(message, max_length: int = 0) -> str:
+    """Format a LangChain message similar to notebooks/utils.py.
+
+    Parts are consumed lazily and formatting stops once `max_length` is exceeded,
+    so the tail of huge tool-call args is never serialized.
+    """
+    cached = _FORMAT_CACHE.get(id(message))
+    if cached is not None and cached[0] is message and cached[1] == max_length:
+        _FORMAT_CACHE.move_to_end(id(message))
+        return cached[2]
+
+    parts, length = [], 0
+    for part in _iter_message_content_parts(message):
+        if not part:
+            continue
+        # Account for the newline separator between parts
+        length += len(part) + (1 if parts else 0)
+        parts.append(part)
+        if max_length and length > max_length:
+            break
+    content = "\n".join(parts)
+    if max_length and len(content) > max_length:
+        content = content[:max_length] + " ... (truncated)"
+
+    _FORMAT_CACHE[id(message)] = (message, max_length, content)
+    if len(_FORMAT_CACHE) > _FORMAT_CACHE_SIZE:
+        _FORMAT_CACHE.popitem(last=False)
+    return content
+
+
+def _iter_message_content_parts(message):
     tool_calls_processed = False
 
     # Main content
     content = getattr(message, "content", "")
     if isinstance(content, str):
-        parts.append(content)
+        yield content
     elif isinstance(content, list):
         # Anthropic-style content with tool_use items
         for item in content:
             if isinstance(item, dict) and item.get("type") == "text":
-                parts.append(item.get("text", ""))
+                yield item.get("text", "")
             elif isinstance(item, dict) and item.get("type") == "tool_use":
-                parts.append(f"\n🔧 Tool Call: {item.get('name')}")
-                parts.append(f"   Args: {json.dumps(item.get('input', {}), indent=2, ensure_ascii=False)}")
-                parts.append(f"   ID: {item.get('id', 'N/A')}")
+                yield f"\n🔧 Tool Call: {item.get('name')}"
+                yield f"   Args: {_dumps_args(item.get('input', {}))}"
+                yield f"   ID: {item.get('id', 'N/A')}"
                 tool_calls_processed = True
     else:
-        parts.append(str(content))
+        yield str(content)
 
     # OpenAI-style tool_calls attached to the message
     if not tool_calls_processed and hasattr(message, "tool_calls") and message.tool_calls:
@@ -50,7 +99,7 @@ def _format_message_content_rich_like(message) -> str:
                 args = getattr(tc, "args", None)
                 call_id = getattr(tc, "id", None)
 
-            parts.append(f"\n🔧 Tool Call: {name or 'tool'}")
+            yield f"\n🔧 Tool Call: {name or 'tool'}"
             if args is not None:
                 # Try to load stringified JSON for readability
                 if isinstance(args, str):
@@ -58,15 +107,13 @@ def _format_message_content_rich_like(message) -> str:
                         args = json.loads(args)
                     except Exception:
                         pass
-                parts.append("   Args: " + json.dumps(args, indent=2, ensure_ascii=False))
+                yield "   Args: " + _dumps_args(args)
             if call_id:
-                parts.append(f"   ID: {call_id}")
+                yield f"   ID: {call_id}"
 
     # Helpful linkage when debugging tool messages
     if message.__class__.__name__.endswith("ToolMessage") and hasattr(message, "tool_call_id"):
-        parts.append(f"\nCall ID: {getattr(message, 'tool_call_id')}")
-
-    return "\n".join([p for p in parts if p])
+        yield f"\nCall ID: {getattr(message, 'tool_call_id')}"
 
 
 def _panel_title_and_style_for_message(message):
@@ -94,9 +141,7 @@ def _print_one_message_pretty(message, max_length: int):
             print(f"Call ID: {message.tool_call_id}\n")
         return
 
-    content = _format_message_content_rich_like(message)
-    if max_length and len(content) > max_length:
-        content = content[:max_length] + " ... (truncated)"
+    content = _format_message_content_rich_like(message, max_length)
     title, style = _panel_title_and_style_for_message(message)
     console.print(Panel(content, title=title, border_style=style))
 
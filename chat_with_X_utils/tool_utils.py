@@ -3,20 +3,38 @@ import re
 from typing import *
 
 from langchain_core.documents import Document
-from langchain_community.document_loaders import PyPDFLoader
 
+import pymupdf
 import yt_dlp
 from youtube_transcript_api import YouTubeTranscriptApi
-from pypdf import PdfReader
 from urllib.parse import urlparse
 from urllib.request import urlopen
-from io import BytesIO
+
+try:
+    from diskcache import Cache
+except ImportError:
+    Cache = None
+
+
+_WS_RE = re.compile(r"\s+")
+_SLUG_STRIP_RE = re.compile(r"[^0-9A-Za-z_\-\| ]+")
+_YT_ID_RES = [
+    re.compile(r'(?:v=|\/)([0-9A-Za-z_-]{11}).*'),
+    re.compile(r'(?:embed\/)([0-9A-Za-z_-]{11})'),
+    re.compile(r'(?:watch\?v=)([0-9A-Za-z_-]{11})'),
+]
+# On-disk cache for YouTube transcripts and metadata, keyed by video ID
+_YT_CACHE_DIR = os.path.expanduser("~/.cache/agent-tutorial/yt")
+_YT_CACHE_EXPIRE = 24 * 60 * 60
+_yt_cache = None
+# Preformatted chunk-id suffixes ("__0000", "__0001", ...)
+_IDX_FMT = [f"__{i:04d}" for i in range(10000)]
 
 
 def _slug(text: str) -> str:
     """Convert text to lightweight slug keeping alnum, underscore, dash, pipe."""
-    text = re.sub(r"\s+", " ", text.strip())
-    return re.sub(r"[^0-9A-Za-z_\-\| ]+", "", text).replace(" ", "_")
+    text = _WS_RE.sub(" ", text.strip())
+    return _SLUG_STRIP_RE.sub("", text).replace(" ", "_")
 
 
 def build_doc_key(doc_type: str, title: str, uploader: Optional[str] = None) -> str:
@@ -36,6 +54,21 @@ def build_doc_key(doc_type: str, title: str, uploader: Optional[str] = None) ->
     return _slug(title)
 
 
+def _chunk_id(doc_key: str, index: int) -> str:
+    """Chunk ID `<doc_key>__<index:04d>` used for all chunks of a document."""
+    if index < len(_IDX_FMT):
+        return doc_key + _IDX_FMT[index]
+    return f"{doc_key}__{index:04d}"
+
+
+def _get_yt_cache():
+    """Return the shared YouTube disk cache, or None if diskcache is not installed."""
+    global _yt_cache
+    if _yt_cache is None and Cache is not None:
+        _yt_cache = Cache(_YT_CACHE_DIR)
+    return _yt_cache
+
+
 def get_video_id(url: str) -> str:
     """Extract YouTube video ID from a variety of URL formats.
 
@@ -45,13 +78,8 @@ def get_video_id(url: str) -> str:
     Returns:
         11-character video ID string or None if not found.
     """
-    patterns = [
-        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
-        r'(?:embed\/)([0-9A-Za-z_-]{11})',
-        r'(?:watch\?v=)([0-9A-Za-z_-]{11})'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
+    for pattern in _YT_ID_RES:
+        match = pattern.search(url)
         if match:
             return match.group(1)
     return None
@@ -74,42 +102,56 @@ def load_youtube_hybrid(url: str, chunk_seconds: int = 120) -> List[Document]:
     if not video_id:
         raise ValueError(f"Could not extract video ID from URL: {url}")
 
-    try:
-        # Updated API: fetch returns a FetchedTranscript with .snippets entries
-        transcript = YouTubeTranscriptApi().fetch(video_id=video_id)
-    except Exception as e:
-        raise Exception(f"Failed to get transcript: {e}")
+    cache = _get_yt_cache()
+    snippets = cache.get(('transcript', video_id)) if cache is not None else None
+    if snippets is None:
+        try:
+            # Updated API: fetch returns a FetchedTranscript with .snippets entries
+            transcript = YouTubeTranscriptApi().fetch(video_id=video_id)
+        except Exception as e:
+            raise Exception(f"Failed to get transcript: {e}")
+        snippets = [
+            {'text': entry.text, 'start': entry.start, 'duration': entry.duration}
+            for entry in transcript.snippets
+        ]
+        if cache is not None:
+            cache.set(('transcript', video_id), snippets, expire=_YT_CACHE_EXPIRE)
 
     metadata = {'video_id': video_id, 'url': url}
-    try:
-        ydl_opts = {'quiet': True, 'no_warnings': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            metadata.update({
-                'title': info.get('title', f'Video {video_id}'),
-                'duration': info.get('duration', 0),
-                'uploader': info.get('uploader', 'Unknown'),
-                'upload_date': info.get('upload_date', ''),
-                'description': info.get('description', '')[:500]
-            })
-    except:
-        metadata['title'] = f'Video {video_id}'
+    info = cache.get(('info', video_id)) if cache is not None else None
+    if info is None:
+        try:
+            ydl_opts = {'quiet': True, 'no_warnings': True}
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                info = {
+                    'title': info.get('title', f'Video {video_id}'),
+                    'duration': info.get('duration', 0),
+                    'uploader': info.get('uploader', 'Unknown'),
+                    'upload_date': info.get('upload_date', ''),
+                    'description': info.get('description', '')[:500]
+                }
+            if cache is not None:
+                cache.set(('info', video_id), info, expire=_YT_CACHE_EXPIRE)
+        except:
+            info = {'title': f'Video {video_id}'}
+    metadata.update(info)
 
     chunks = []
-    current_chunk = {'text': '', 'start_time': 0, 'end_time': 0}
-    # Updated API iteration: iterate over transcript.snippets with attribute access
-    for entry in transcript.snippets:
-        if entry.start - current_chunk['start_time'] >= chunk_seconds and current_chunk['text']:
-            chunks.append(current_chunk.copy())
+    # Collect text parts per chunk and join once, instead of repeated string concatenation
+    current_chunk = {'parts': [], 'start_time': 0, 'end_time': 0}
+    for entry in snippets:
+        if entry['start'] - current_chunk['start_time'] >= chunk_seconds and current_chunk['parts']:
+            chunks.append(current_chunk)
             current_chunk = {
-                'text': entry.text,
-                'start_time': entry.start,
-                'end_time': entry.start + entry.duration
+                'parts': [entry['text']],
+                'start_time': entry['start'],
+                'end_time': entry['start'] + entry['duration']
             }
         else:
-            current_chunk['text'] += ' ' + entry.text
-            current_chunk['end_time'] = entry.start + entry.duration
-    if current_chunk['text']:
+            current_chunk['parts'].append(entry['text'])
+            current_chunk['end_time'] = entry['start'] + entry['duration']
+    if current_chunk['parts']:
         chunks.append(current_chunk)
 
     documents = []
@@ -117,7 +159,7 @@ def load_youtube_hybrid(url: str, chunk_seconds: int = 120) -> List[Document]:
         start_min = int(chunk['start_time'] // 60)
         start_sec = int(chunk['start_time'] % 60)
         documents.append(Document(
-            page_content=chunk['text'].strip(),
+            page_content=' '.join(chunk['parts']).strip(),
             metadata={
                 **metadata,
                 'chunk_index': i,
@@ -129,6 +171,33 @@ def load_youtube_hybrid(url: str, chunk_seconds: int = 120) -> List[Document]:
     return documents
 
 
+# Document-level PDF metadata copied onto every page, like PyPDFLoader does
+PDF_METADATA_KEYS = ("title", "author", "subject")
+
+
+def _load_pdf_pages(source, is_url: bool) -> List[Document]:
+    """Extract one Document per PDF page with PyMuPDF (same metadata keys as PyPDFLoader)."""
+    if is_url:
+        with urlopen(source) as resp:
+            pdf = pymupdf.open(stream=resp.read(), filetype="pdf")
+    else:
+        pdf = pymupdf.open(source)
+    with pdf:
+        # PyMuPDF reports missing fields as empty strings
+        pdf_metadata = {
+            key: value.strip()
+            for key in PDF_METADATA_KEYS
+            if (value := (pdf.metadata or {}).get(key) or "").strip()
+        }
+        return [
+            Document(
+                page_content=page.get_text("text"),
+                metadata={**pdf_metadata, 'source': source, 'page': page.number, 'total_pages': pdf.page_count}
+            )
+            for page in pdf
+        ]
+
+
 def get_documents(source, doc_type):
     if doc_type == "youtube":
         documents = load_youtube_hybrid(source, chunk_seconds=120)
@@ -137,45 +206,13 @@ def get_documents(source, doc_type):
         uploader = first_meta.get('uploader', 'unknown')
         doc_key = build_doc_key('youtube', title, uploader)
     elif doc_type == "pdf":
-        loader = PyPDFLoader(source)
-        documents = loader.load()
+        is_url = isinstance(source, str) and (source.startswith("http://") or source.startswith("https://"))
+        documents = _load_pdf_pages(source, is_url)
 
         # Prefer embedded PDF metadata title; fallback to filename/URL segment
-        title = None
-        try:
-            if isinstance(source, str) and (source.startswith("http://") or source.startswith("https://")):
-                try:
-                    with urlopen(source) as resp:
-                        data = resp.read()
-                    reader = PdfReader(BytesIO(data))
-                except Exception:
-                    reader = None
-                # Fallback filename from URL path if no metadata title
-                url_path = urlparse(source).path or ""
-                url_basename = os.path.basename(url_path)
-                if not title and url_basename:
-                    title = url_basename
-            else:
-                try:
-                    reader = PdfReader(source)
-                except Exception:
-                    reader = None
-
-            meta_title = None
-            if reader:
-                md = getattr(reader, "metadata", None)
-                if md is not None:
-                    # Try pypdf's attribute access first, then dict-style key
-                    meta_title = getattr(md, "title", None)
-                    if not meta_title and isinstance(md, dict):
-                        meta_title = md.get("/Title")
-            if meta_title:
-                meta_title = str(meta_title).strip()
-                if meta_title:
-                    title = meta_title
-        except Exception:
-            # Ignore metadata errors; we'll fallback below
-            pass
+        title = documents[0].metadata.get("title") if documents else None
+        if not title and is_url:
+            title = os.path.basename(urlparse(source).path or "")
 
         if not title:
             # Local file fallback
@@ -196,7 +233,7 @@ def embed_documents(doc_info, text_splitter, vector_store, metadata, doc_type):
     chunks = text_splitter.split_documents(documents) if doc_type == "pdf" else documents
     if doc_key in metadata:
         old_num = metadata[doc_key]['num_chunks']
-        old_ids = [f"{doc_key}__{i:04d}" for i in range(old_num)]
+        old_ids = [_chunk_id(doc_key, i) for i in range(old_num)]
         try:
             vector_store.delete(ids=old_ids)
         except Exception:
@@ -209,7 +246,7 @@ def embed_documents(doc_info, text_splitter, vector_store, metadata, doc_type):
         if doc_type == 'youtube':
             chunk.metadata['uploader'] = uploader
         chunk.metadata['doc_type'] = doc_type
-        chunk_ids.append(f"{doc_key}__{i:04d}")
+        chunk_ids.append(_chunk_id(doc_key, i))
     vector_store.add_documents(chunks, ids=chunk_ids)
 
     return doc_info, chunks
@@ -222,7 +259,7 @@ def delete_documents_from_store(metadata, doc_keys, vector_store):
             not_found.append(key)
             continue
         num = metadata[key]['num_chunks']
-        chunk_ids = [f"{key}__{i:04d}" for i in range(num)]
+        chunk_ids = [_chunk_id(key, i) for i in range(num)]
         try:
             vector_store.delete(ids=chunk_ids)
         except Exception:
@@ -0,0 +1,77 @@
+"""
+Coalesces concurrent single-query lookups into batched Chroma queries.
+Queries that arrive within a short window are sent as one `collection.query` call and the results are fanned back out.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Any
+
+from chromadb import Collection
+
+
+def split_query_result(result: dict[str, Any], index: int) -> dict[str, Any]:
+    """Extract the result of the `index`-th query from a batched Chroma query result."""
+    return {
+        key: [value[index]] if isinstance(value, list) and key != 'included' else value
+        for key, value in result.items()
+    }
+
+
+class QueryBatcher:
+    """Collect queries for `window` seconds and run them as one batched collection query."""
+
+    def __init__(self, collection: Collection, window: float = 0.01, max_batch: int = 64):
+        """
+        Initialize the batcher.
+
+        Args:
+            collection: Chroma collection to query
+            window: Seconds to wait for more queries after the first one arrives
+            max_batch: Maximum number of queries sent in one call
+        """
+        self.collection = collection
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def query(self, query_embedding, n_results: int) -> dict[str, Any]:
+        """Queue a single query and wait for its share of the batched result."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query_embedding, n_results, future))
+        return await future
+
+    async def run(self):
+        """Serve queued queries until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # n_results is a per-call argument, so only queries that share it can be batched
+            groups = defaultdict(list)
+            for item in pending:
+                groups[item[1]].append(item)
+            for n_results, items in groups.items():
+                try:
+                    result = await asyncio.to_thread(
+                        self.collection.query,
+                        query_embeddings=[list(query_embedding) for query_embedding, _, _ in items],
+                        n_results=n_results,
+                    )
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for i, (_, _, future) in enumerate(items):
+                    if not future.done():
+                        future.set_result(split_query_result(result, i))
@@ -5,16 +5,23 @@ Monitors a directory recursively for file changes and triggers custom functions.
 """
 
 import asyncio
-import itertools
-import uuid
-from copy import deepcopy
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
+import pymupdf
 import numpy as np
 from chromadb.api import ClientAPI as ClientAPI
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_community.document_loaders import TextLoader
+from langchain_core.documents import Document
 from watchdog.events import (
     FileCreatedEvent,
     FileDeletedEvent,
@@ -24,10 +31,61 @@ from watchdog.events import (
 from watchdog.observers import Observer
 
 
+# Metadata for the Chroma collections; must match wherever the collections are opened
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+
+# Substrings that mark editor/temporary files
+_TEMP_FILE_RE = re.compile(r"\.tmp|\.swp|~|\.lock|#")
+
+
+def _iter_files(root, file_extensions):
+    """Recursively yield `os.DirEntry`s of files below root whose suffix is in file_extensions.
+
+    Like `FileChangeHandler`, an empty or None file_extensions matches every file.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path, file_extensions)
+            elif not file_extensions or os.path.splitext(entry.name)[1].lower() in file_extensions:
+                yield entry
+
+
+# Document-level PDF metadata copied onto every page, like PyPDFLoader does
+PDF_METADATA_KEYS = ('title', 'author', 'subject')
+
+
+def _load_pdf_pages(file_path):
+    """Extract one Document per PDF page with PyMuPDF (same metadata keys as PyPDFLoader)."""
+    with pymupdf.open(file_path) as pdf:
+        # PyMuPDF reports missing fields as empty strings
+        pdf_metadata = {
+            key: value.strip()
+            for key in PDF_METADATA_KEYS
+            if (value := (pdf.metadata or {}).get(key) or '').strip()
+        }
+        return [
+            Document(
+                page_content=page.get_text("text"),
+                metadata={**pdf_metadata, 'source': str(file_path), 'page': page.number, 'total_pages': pdf.page_count}
+            )
+            for page in pdf
+        ]
+
+
+def _chunk_id(relative_path: str, index: int, text: str) -> str:
+    """Content-addressed chunk id, stable across re-syncs of an unchanged file."""
+    h = hashlib.sha256()
+    h.update(relative_path.encode())
+    h.update(index.to_bytes(4, 'little'))
+    h.update(text.encode())
+    return h.hexdigest()[:32]
+
+
 class FileChangeHandler(FileSystemEventHandler):
     """Custom handler for file system events."""
     
-    def __init__(self, callback=None, file_extensions=None, ignore_temp=True):
+    def __init__(self, callback=None, file_extensions=None, ignore_temp=True, debounce_seconds=1.0):
         """
         Initialize the handler.
         
@@ -35,26 +93,31 @@ class FileChangeHandler(FileSystemEventHandler):
             callback: Function to call when files change (receives file path)
             file_extensions: Set of extensions to monitor (e.g., {'.py', '.txt'})
             ignore_temp: Whether to ignore temporary files
+            debounce_seconds: Quiet period after the last modification before a file is synced
         """
         super().__init__()
         self.callback = callback or self.default_callback
         self.file_extensions = file_extensions
         self.ignore_temp = ignore_temp
-        self.store = {'created': set(), 'modified': set(), 'deleted': set()}
+        self.debounce_seconds = debounce_seconds
+        # 'modified' maps path -> monotonic time of the last modification event
+        self.store = {'created': set(), 'modified': {}, 'deleted': set()}
+        # Guards `store`, which is filled from the observer thread and drained by `sync`
+        self.lock = threading.Lock()
+        # Set while `store` holds events that have not been synced yet
+        self.has_events = threading.Event()
         
     def should_process_file(self, file_path):
         """Determine if a file should trigger the callback."""
-        path = Path(file_path)
+        path = file_path if isinstance(file_path, Path) else Path(file_path)
         
         # Skip directories
         if path.is_dir():
             return False
             
         # Skip temporary files if requested
-        if self.ignore_temp:
-            temp_patterns = ['.tmp', '.swp', '~', '.lock', '#']
-            if any(pattern in path.name for pattern in temp_patterns):
-                return False
+        if self.ignore_temp and _TEMP_FILE_RE.search(path.name):
+            return False
                 
         # Check file extensions if specified
         if self.file_extensions:
@@ -66,29 +129,63 @@ class FileChangeHandler(FileSystemEventHandler):
         """Handle file modification events."""
         if isinstance(event, FileModifiedEvent) and not event.is_directory:
             if self.should_process_file(event.src_path):
-                self.store['modified'].add(event.src_path)
+                with self.lock:
+                    self.store['modified'][event.src_path] = time.monotonic()
+                    self.has_events.set()
                 self.callback(event.src_path, 'modified')
     
     def on_created(self, event):
         """Handle file creation events."""
         if isinstance(event, FileCreatedEvent) and not event.is_directory:
             if self.should_process_file(event.src_path):
-                self.store['created'].add(event.src_path)
+                with self.lock:
+                    self.store['created'].add(event.src_path)
+                    self.has_events.set()
                 self.callback(event.src_path, 'created')
 
     def on_deleted(self, event):
         if isinstance(event, FileDeletedEvent) and not event.is_directory:
             if self.should_process_file(event.src_path) and not event.is_directory:
-                if event.src_path in self.store['created']:
-                    self.store['created'].remove(event.src_path)
-                    self.store['modified'].discard(event.src_path)
-                else:
-                    self.store['deleted'].add(event.src_path)
+                with self.lock:
+                    self.store['modified'].pop(event.src_path, None)
+                    if event.src_path in self.store['created']:
+                        self.store['created'].remove(event.src_path)
+                    else:
+                        self.store['deleted'].add(event.src_path)
+                    self.has_events.set()
                 self.callback(event.src_path, 'deleted')
 
     def clear_store(self):
-        self.store = {'created': set(), 'modified': set(), 'deleted': set()}
+        self.store = {'created': set(), 'modified': {}, 'deleted': set()}
+
+    def pop_settled(self):
+        """Remove and return the events that are ready to sync.
+
+        Files modified within the last `debounce_seconds` (including newly created
+        ones still being written) stay in the store for a later call.
+        """
+        now = time.monotonic()
+        settled_modified = set()
+        with self.lock:
+            store = self.store
+            self.clear_store()
+            for file_path, last_event in store['modified'].items():
+                if now - last_event > self.debounce_seconds:
+                    settled_modified.add(file_path)
+                    continue
+                self.store['modified'][file_path] = last_event
+                if file_path in store['created']:
+                    store['created'].remove(file_path)
+                    self.store['created'].add(file_path)
+            if not self.store['modified']:
+                self.has_events.clear()
+        return {'created': store['created'], 'modified': settled_modified, 'deleted': store['deleted']}
     
+    def pending_count(self):
+        """Number of files with events that have not been synced yet."""
+        with self.lock:
+            return len(self.store['created']) + len(self.store['modified']) + len(self.store['deleted'])
+
     def default_callback(self, file_path, event_type):
         """Default callback function."""
         print(f"File {event_type}: {file_path}")
@@ -97,7 +194,7 @@ class FileChangeHandler(FileSystemEventHandler):
 class RecursiveFileEmbedder:
     """Main directory watcher class."""
     
-    def __init__(self, directory, chroma_client: ClientAPI, file_extensions={'.md', '.txt', '.pdf'}, ignore_temp=True, callback=None):
+    def __init__(self, directory, chroma_client: ClientAPI, file_extensions={'.md', '.txt', '.pdf'}, ignore_temp=True, callback=None, max_workers=4, document_chunks=None, on_change=None):
         """
         Initialize the directory watcher.
         
@@ -106,13 +203,29 @@ class RecursiveFileEmbedder:
             file_extensions: Set of file extensions to monitor
             ignore_temp: Whether to ignore temporary files
             callback: Function to call on file changes
+            max_workers: Number of files loaded and embedded concurrently
+            document_chunks: Dict kept up to date with the chunk ids of every indexed document
+            on_change: Function called without arguments after each write to Chroma, e.g. to drop cached results
         """
         self.directory = Path(directory).resolve()
         self.observer = Observer()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Serializes writes to Chroma, so that only one batch touches the collections at a time
+        self._write_lock = threading.Lock()
         self.handler = FileChangeHandler(callback, file_extensions, ignore_temp)
         self.chroma_client: ClientAPI = chroma_client 
-        self.documents_collection = self.chroma_client.get_or_create_collection("documents")
-        self.chunks_collection = self.chroma_client.get_or_create_collection("chunks")
+        self.documents_collection = self.chroma_client.get_or_create_collection("documents", metadata=COLLECTION_METADATA)
+        self.chunks_collection = self.chroma_client.get_or_create_collection("chunks", metadata=COLLECTION_METADATA)
+        # Embed chunks ourselves so the vectors can be reused for the document average
+        self._embed = self.chunks_collection._embedding_function
+        # Relative paths of the files indexed in the documents collection, filled by `sync_directory_modifications`
+        self._known_docs: set[str] = set()
+        # Inverted index document -> chunk ids; lists are replaced, never mutated, so readers can share it
+        self.document_chunks: dict[str, list[str]] = document_chunks if document_chunks is not None else {}
+        self.on_change = on_change
+        # Lets `stop` run while `start` is still syncing: a stopped watcher never starts its observer
+        self._lifecycle_lock = threading.Lock()
+        self._stopped = False
         
         if not self.directory.exists():
             raise FileNotFoundError(f"Directory does not exist: {self.directory}")
@@ -121,54 +234,138 @@ class RecursiveFileEmbedder:
         """Start watching the directory."""
         print(f"Starting to watch directory: {self.directory}")
         self.sync_directory_modifications()
-        self.observer.schedule(self.handler, str(self.directory), recursive=True)
-        self.observer.start()
+        with self._lifecycle_lock:
+            if self._stopped:
+                return
+            self.observer.schedule(self.handler, str(self.directory), recursive=True)
+            self.observer.start()
         
     def stop(self):
         """Stop watching the directory."""
         print("Stopping directory watcher...")
-        self.observer.stop()
-        self.observer.join()
+        with self._lifecycle_lock:
+            self._stopped = True
+            started = self.observer.is_alive()
+        if started:
+            self.observer.stop()
+            self.observer.join()
+        self._executor.shutdown(wait=True)
 
     def sync_directory_modifications(self):
-        files = set(itertools.chain(
-            self.directory.glob("**/*.pdf"), 
-            self.directory.glob("**/*.md"), 
-            self.directory.glob("**/*.txt")
-        ))
-
         chroma_documents = self.documents_collection.get(include=['metadatas'])
-        chroma_files = {self.directory / doc_id for doc_id in chroma_documents['ids']}
-        new_files = files.difference(chroma_files)
-        deleted_files = chroma_files.difference(files)
-
-        files_last_modified = {file: datetime.fromtimestamp(file.stat().st_mtime) for file in files}
-        chroma_documents_last_modified = {self.directory / doc_id: datetime.fromtimestamp(metadata['last_modified']) for doc_id, metadata in zip(chroma_documents['ids'], chroma_documents['metadatas'])}
+        self._known_docs = set(chroma_documents['ids'])
+        chroma_chunks = self.chunks_collection.get(include=['metadatas'])
+        document_chunks = defaultdict(list)
+        for chunk_id, metadata in zip(chroma_chunks['ids'], chroma_chunks['metadatas']):
+            document_chunks[metadata['document']].append(chunk_id)
+        self.document_chunks.clear()
+        self.document_chunks.update(document_chunks)
+        chroma_last_modified = dict(zip(
+            chroma_documents['ids'],
+            (metadata['last_modified'] for metadata in chroma_documents['metadatas'])
+        ))
 
+        # Single walk over the tree, filtered by the configured extensions. Paths stay strings
+        # (scandir already joins them); only files that need embedding become Path objects.
+        base_str = os.fspath(self.directory)
+        prefix_len = len(os.path.join(base_str, ''))
+        new_files = set()
         modified_files = set()
-        for file in files:
-            if file in files_last_modified.keys() and file in chroma_documents_last_modified.keys():
-                if files_last_modified[file] > chroma_documents_last_modified[file]:
-                    modified_files.add(file)
-        
-        
+        for entry in _iter_files(base_str, self.handler.file_extensions):
+            previous = chroma_last_modified.pop(entry.path[prefix_len:], None)
+            if previous is None:
+                new_files.add(Path(entry.path))
+            elif entry.stat().st_mtime > previous:
+                modified_files.add(Path(entry.path))
+        # Whatever is left in Chroma no longer exists on disk
+        deleted_files = {self.directory / doc_id for doc_id in chroma_last_modified}
+
         for file in new_files.union(modified_files):
             print(f"Inserting new file to chroma: {file}")
-            self.upsert_file(file)
+        self._upsert_files(new_files.union(modified_files))
 
         for file in deleted_files:
             print(f"Deleting file from chroma: {file}")
-            self.delete_file(file)
+        self._delete_files(deleted_files)
 
-    def upsert_file(self, file_path: Path):
-        self.delete_file(file_path=file_path)
+    def _upsert_files(self, file_paths, files_per_write=32):
+        """Load and embed files concurrently, then write them to Chroma in batched calls.
+
+        Files are handled in groups of `files_per_write` to bound the memory held between
+        embedding and writing.
+        """
+        file_paths = list(file_paths)
+        for start in range(0, len(file_paths), files_per_write):
+            # Files that failed to load or embed come back as None and are skipped
+            prepared = [
+                file for file in self._executor.map(self._prepare_file, file_paths[start:start + files_per_write])
+                if file is not None
+            ]
+            if prepared:
+                self._write_prepared_files(prepared)
+
+    def _write_prepared_files(self, prepared):
+        with self._write_lock:
+            self._write_prepared_files_locked(prepared)
+        if self.on_change is not None:
+            self.on_change()
+
+    def _write_prepared_files_locked(self, prepared):
+        stale_ids = [chunk_id for file in prepared for chunk_id in file['stale_ids']]
+        for batch in self._batches(len(stale_ids)):
+            self.chunks_collection.delete(ids=stale_ids[batch])
+
+        chunk_ids = [chunk_id for file in prepared for chunk_id in file['chunk_ids']]
+        texts = [text for file in prepared for text in file['texts']]
+        metadatas = [metadata for file in prepared for metadata in file['metadatas']]
+        vectors = np.concatenate([file['vectors'] for file in prepared])
+        for batch in self._batches(len(chunk_ids)):
+            self.chunks_collection.upsert(
+                ids=chunk_ids[batch],
+                embeddings=vectors[batch],
+                documents=texts[batch],
+                metadatas=metadatas[batch],
+            )
+
+        document_ids = [file['document_id'] for file in prepared]
+        document_embeddings = [file['vectors'].mean(axis=0, dtype=np.float32) for file in prepared]
+        document_texts = [file['full_text'] for file in prepared]
+        document_metadatas = [{'last_modified': file['last_modified']} for file in prepared]
+        for batch in self._batches(len(document_ids)):
+            self.documents_collection.upsert(
+                ids=document_ids[batch],
+                embeddings=document_embeddings[batch],
+                documents=document_texts[batch],
+                metadatas=document_metadatas[batch],
+            )
+        self._known_docs.update(document_ids)
+        for file in prepared:
+            self.document_chunks[file['document_id']] = file['chunk_ids']
+
+    def _batches(self, n):
+        """Yield slices covering range(n) that respect Chroma's maximum batch size."""
+        batch_size = self.chroma_client.get_max_batch_size()
+        for start in range(0, n, batch_size):
+            yield slice(start, start + batch_size)
+
+    def _prepare_file(self, file_path: Path) -> Optional[dict]:
+        """Load, split and embed a file without writing to Chroma; None if that failed.
+
+        Errors are reported per file, so one unreadable file does not stop the others from being indexed.
+        """
+        try:
+            return self._load_and_embed_file(file_path)
+        except Exception as e:
+            print(f"Failed to embed {file_path}: {e!r}")
+            return None
+
+    def _load_and_embed_file(self, file_path: Path) -> dict:
         relative_file_path = file_path.relative_to(self.directory)
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        doc_type = file_path.suffix[1:]
+        doc_type = file_path.suffix[1:].lower()
 
         if doc_type == "pdf":
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
+            documents = _load_pdf_pages(file_path)
         elif doc_type in ('md', 'txt') :
             loader = TextLoader(file_path)
             documents = loader.load()
@@ -176,60 +373,122 @@ class RecursiveFileEmbedder:
             raise RuntimeError(f"No Loader for file {file_path}.")
 
         now = datetime.now().timestamp()
-        # Insert chunks in vector DB
         chunks = text_splitter.split_documents(documents)
         if len(chunks) == 0:
             chunks = documents
-        for chunk in chunks:
-            chunk.metadata["document"] = str(relative_file_path)
-            chunk.metadata["last_modified"] = now
-        chunk_ids = [str(uuid.uuid4()) for _ in chunks]
-        self.chunks_collection.add(
-            ids=chunk_ids,
-            documents=[chunk.page_content for chunk in chunks],
-            metadatas=[chunk.metadata for chunk in chunks],
-        )
-
-        # Insert document in vector DB
-        results = self.chunks_collection.get(ids=chunk_ids, include=['embeddings'])
-        embeddings = results['embeddings']
-        document_embedding = np.average(embeddings, axis=0)
-        document_full_text = " ".join([page.page_content for page in documents])
-        self.documents_collection.add(
-            ids=[str(relative_file_path)],
-            embeddings=[document_embedding],
-            documents=[document_full_text],
-            metadatas=[{'last_modified': now}]
-        )
-        # f"Added document {relative_file_path} and {len(chunks)} chunks to the vector database."
+        base_metadata = {"document": str(relative_file_path), "last_modified": now}
+        chunk_ids, texts, metadatas = [], [], []
+        for i, chunk in enumerate(chunks):
+            chunk_ids.append(_chunk_id(str(relative_file_path), i, chunk.page_content))
+            texts.append(chunk.page_content)
+            metadatas.append({**chunk.metadata, **base_metadata})
+
+        # Only embed chunks that are not already stored, and drop the ones that vanished
+        known_rows: dict[str, int] = {}
+        known_chunk_ids = self.document_chunks.get(str(relative_file_path))
+        if known_chunk_ids:
+            existing = self.chunks_collection.get(ids=known_chunk_ids, include=['embeddings'])
+            # Chroma returns the embeddings as one ndarray; index its rows rather than copying vectors out
+            known_vectors = np.asarray(existing['embeddings'], dtype=np.float32)
+            known_rows = {chunk_id: row for row, chunk_id in enumerate(existing['ids'])}
+        stale_ids = known_rows.keys() - set(chunk_ids)
+        missing = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in known_rows]
+        reused = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id in known_rows]
+        if missing:
+            new_vectors = np.asarray(self._embed([texts[i] for i in missing]), dtype=np.float32)
+            dim = new_vectors.shape[1]
+        else:
+            dim = known_vectors.shape[1]
+        # Fill one contiguous float32 matrix; row assignment also checks the dimensionality
+        vectors = np.empty((len(chunk_ids), dim), dtype=np.float32)
+        if missing:
+            vectors[missing] = new_vectors
+        if reused:
+            vectors[reused] = known_vectors[[known_rows[chunk_ids[i]] for i in reused]]
+
+        # Text files load as a single document, so only multi-page PDFs need joining
+        if len(documents) == 1:
+            document_full_text = documents[0].page_content
+        else:
+            document_full_text = " ".join([page.page_content for page in documents])
+
+        return {
+            'document_id': str(relative_file_path),
+            'last_modified': now,
+            'chunk_ids': chunk_ids,
+            'texts': texts,
+            'metadatas': metadatas,
+            'vectors': vectors,
+            'stale_ids': stale_ids,
+            'full_text': document_full_text,
+        }
+
+    def upsert_file(self, file_path: Path):
+        self._upsert_files([file_path])
+
+    def _delete_files(self, file_paths):
+        """Remove files and their chunks with one delete per collection."""
+        relative_file_paths = [str(file_path.relative_to(self.directory)) for file_path in file_paths]
+        with self._write_lock:
+            relative_file_paths = [path for path in relative_file_paths if path in self._known_docs]
+            for batch in self._batches(len(relative_file_paths)):
+                self.chunks_collection.delete(where={"document": {"$in": relative_file_paths[batch]}})
+                self.documents_collection.delete(ids=relative_file_paths[batch])
+            self._known_docs.difference_update(relative_file_paths)
+            for path in relative_file_paths:
+                self.document_chunks.pop(path, None)
+        if relative_file_paths and self.on_change is not None:
+            self.on_change()
 
     def delete_file(self, file_path: Path):
-        relative_file_path = str(file_path.relative_to(self.directory))
-        self.chunks_collection.delete(where={"document": relative_file_path})
-        self.documents_collection.delete(ids=[relative_file_path])
+        self._delete_files([file_path])
 
     def sync(self):
-        store_snapshot: dict[str, set] = deepcopy(self.handler.store)
-        self.handler.clear_store()
+        store_snapshot: dict[str, set] = self.handler.pop_settled()
+        upserts = []
         for file_path in store_snapshot['created'].union(store_snapshot['modified']):
             file_path = Path(file_path)
             print(f'c/m {file_path}')
             doc_type = file_path.suffix
-            assert doc_type in self.handler.file_extensions
-            self.upsert_file(file_path)
+            assert not self.handler.file_extensions or doc_type in self.handler.file_extensions
+            upserts.append(file_path)
+        self._upsert_files(upserts)
+        deletions = []
         for file_path in store_snapshot['deleted']:
             file_path = Path(file_path)
             print(f'd {file_path}')
-            self.delete_file(file_path)
+            deletions.append(file_path)
+        self._delete_files(deletions)
         
 
-async def embedding_worker(directory, chroma_client, stop_event):
-    watcher = RecursiveFileEmbedder(directory, chroma_client=chroma_client)
-    watcher.start()
+async def embedding_worker(directory, chroma_client, stop_event, document_chunks=None, max_pending=256, flush_interval=0.5,
+                           on_change=None):
+    """Keep Chroma in sync with `directory` until `stop_event` is set.
+
+    Events are synced in bursts: once a change arrives, the worker waits up to `flush_interval`
+    seconds for more (or until `max_pending` files changed) and embeds and writes them together.
+    `on_change` is called after every write to Chroma.
+    """
+    watcher = RecursiveFileEmbedder(
+        directory, chroma_client=chroma_client, document_chunks=document_chunks, on_change=on_change
+    )
+    loop = asyncio.get_running_loop()
     try:
+        # Loading and embedding files is blocking work; keep it off the event loop
+        await asyncio.to_thread(watcher.start)
         while not stop_event.is_set():
-            watcher.sync()
-            await asyncio.sleep(5)
-    except asyncio.CancelledError:
-        watcher.stop()
+            # Short timeout so that stop_event is noticed even when nothing changes
+            if not await asyncio.to_thread(watcher.handler.has_events.wait, 1.0):
+                continue
+            deadline = loop.time() + flush_interval
+            while loop.time() < deadline and watcher.handler.pending_count() < max_pending:
+                await asyncio.sleep(0.05)
+            try:
+                await asyncio.to_thread(watcher.sync)
+            except Exception as e:
+                # Keep watching; the failed changes are picked up by the full sync on the next start
+                print(f"Failed to sync {directory}: {e!r}")
+    finally:
+        # Also runs when cancelled mid-start; joining the observer and executor blocks, so it runs in a thread
+        await asyncio.to_thread(watcher.stop)
 
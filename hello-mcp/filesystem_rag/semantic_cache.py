@@ -0,0 +1,75 @@
+"""
+Small in-process semantic cache for vector DB query results.
+Entries are keyed by the L2-normalized query embedding, so repeated and near-duplicate queries are served without another search.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+import numpy as np
+
+
+class SemanticCache:
+    """LRU cache of query results, looked up by cosine similarity of query embeddings."""
+
+    def __init__(self, threshold: float = 0.9, ttl: float = 300.0, max_entries: int = 512):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a cached query to count as a hit
+            ttl: Seconds after which an entry expires
+            max_entries: Maximum number of cached queries before evicting the least recently used
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Row i of `_vectors` holds the normalized embedding of slot i
+        self._vectors: np.ndarray | None = None
+        # slot -> (scope, result, created), ordered from least to most recently used
+        self._entries: OrderedDict[int, tuple[Hashable, Any, float]] = OrderedDict()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, embedding, scope: Hashable = None) -> Any | None:
+        """Return the cached result of the most similar query with the same scope, or None."""
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if not self._entries:
+                return None
+            slots = np.fromiter(self._entries.keys(), dtype=np.intp, count=len(self._entries))
+            similarities = self._vectors[slots] @ query
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                slot = int(slots[i])
+                entry_scope, result, created = self._entries[slot]
+                if entry_scope == scope and now - created <= self.ttl:
+                    self._entries.move_to_end(slot)
+                    return result
+        return None
+
+    def put(self, embedding, result: Any, scope: Hashable = None):
+        """Store the result of a query, evicting the least recently used entry when full."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                slot = len(self._entries)
+            else:
+                slot, _ = self._entries.popitem(last=False)
+            self._vectors[slot] = vector
+            self._entries[slot] = (scope, result, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -3,17 +3,17 @@ import asyncio
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, AsyncIterator
+from typing import Any, AsyncContextManager, AsyncIterator, Callable
 
 from chromadb import Collection, PersistentClient
 from chromadb.api import ClientAPI
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_context
 
-from recursive_file_embeddings import embedding_worker
+from recursive_file_embeddings import COLLECTION_METADATA, embedding_worker
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppContext():
     """Lifespan Application Context"""
     # Directory that is watched
@@ -23,53 +23,59 @@ class AppContext():
     chunks_collection: Collection
 
 
-@asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-    """Manage application lifecycle with type-safe context."""
-    # Check that directory exists, else create it
-    base_directory = Path(args.directory)
-    base_directory.mkdir(parents=True, exist_ok=True)
+def make_lifespan(base_directory: Path) -> Callable[[FastMCP], AsyncContextManager[AppContext]]:
+    """Create the server lifespan for the given watched directory."""
+    @asynccontextmanager
+    async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+        """Manage application lifecycle with type-safe context."""
+        # Check that directory exists, else create it
+        base_directory.mkdir(parents=True, exist_ok=True)
 
-    # Set up vector DB connection
-    client: ClientAPI = PersistentClient(path=str(base_directory.resolve() /'.chroma'))
-    documents_collection = client.get_or_create_collection("documents")
-    chunks_collection = client.get_or_create_collection("chunks")
+        # Set up vector DB connection
+        client: ClientAPI = PersistentClient(path=str(base_directory.resolve() /'.chroma'))
+        documents_collection = client.get_or_create_collection("documents", metadata=COLLECTION_METADATA)
+        chunks_collection = client.get_or_create_collection("chunks", metadata=COLLECTION_METADATA)
     
-    # Start watchdog for automated embeddings
-    stop_event = asyncio.Event()
-    task = asyncio.create_task(embedding_worker(base_directory, chroma_client=client, stop_event=stop_event))
-    try:
-        # Yield the app context
-        yield AppContext(
-            documents_collection=documents_collection,
-            chunks_collection=chunks_collection,
-            base_directory=base_directory
-        )
-    finally:
-        # Shutdown watchdog service for automated embeddings
-        stop_event.set()
-        task.cancel()
+        # Start watchdog for automated embeddings
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(embedding_worker(base_directory, chroma_client=client, stop_event=stop_event))
         try:
-            await task
-        except asyncio.CancelledError:
-            pass
+            # Yield the app context
+            yield AppContext(
+                documents_collection=documents_collection,
+                chunks_collection=chunks_collection,
+                base_directory=base_directory
+            )
+        finally:
+            # Shutdown watchdog service for automated embeddings
+            stop_event.set()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
 
-# MCP Server objects
-mcp = FastMCP(
-        "LocalFilesystemRAG",
-        instructions="""
-This MCP server is a document retrieval and summarization assistant that automatically syncs with a local directory. It maintains a vector database that continuously watches the configured directory, ensuring the searchable content always reflects the current state of the files. You can use it to semantically search documents, extract content chunks, read full files, and generate summaries - all backed by real-time directory synchronization.""",
-        lifespan=app_lifespan)
+    return app_lifespan
 
-# TODO: Add mcp tools, resources and prompts
+# MCP Server instructions
+INSTRUCTIONS = """
+This MCP server is a document retrieval and summarization assistant that automatically syncs with a local directory. It maintains a vector database that continuously watches the configured directory, ensuring the searchable content always reflects the current state of the files. You can use it to semantically search documents, extract content chunks, read full files, and generate summaries - all backed by real-time directory synchronization."""
 
 
-# CLI argument parsing of directory
-parser = argparse.ArgumentParser(description="Start MCP Server")
-parser.add_argument("--directory", type=str, default="./", help="The base directory to put resources in.")
-args = parser.parse_args()
+def create_server(base_directory: Path) -> FastMCP:
+    """Create the MCP server for the given watched directory."""
+    mcp = FastMCP("LocalFilesystemRAG", instructions=INSTRUCTIONS, lifespan=make_lifespan(base_directory))
+
+    # TODO: Add mcp tools, resources and prompts
+
+    return mcp
+
 
 if __name__ == "__main__":
-    # Run the MCP server
-    mcp.run()
+    # CLI argument parsing of directory
+    parser = argparse.ArgumentParser(description="Start MCP Server")
+    parser.add_argument("--directory", type=str, default="./", help="The base directory to put resources in.")
+    args = parser.parse_args()
 
+    # Run the MCP server
+    create_server(Path(args.directory)).run()
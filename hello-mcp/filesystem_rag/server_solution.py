@@ -1,19 +1,24 @@
 import argparse
 import asyncio
+import functools
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, AsyncIterator
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, List, Optional
 
+import numpy as np
 from chromadb import Collection, PersistentClient
 from chromadb.api import ClientAPI
 from fastmcp import FastMCP
+from fastmcp.exceptions import NotFoundError
 from fastmcp.server.dependencies import get_context
 
-from recursive_file_embeddings import embedding_worker
+from query_batcher import QueryBatcher, split_query_result
+from recursive_file_embeddings import COLLECTION_METADATA, embedding_worker
+from semantic_cache import SemanticCache
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppContext():
     """Lifespan Application Context"""
     # Directory that is watched
@@ -21,64 +26,206 @@ class AppContext():
     # Chroma vector DB collections
     documents_collection: Collection
     chunks_collection: Collection
+    # Embeds a single query string (memoized)
+    embed_query: Callable[[str], tuple[float, ...]]
+    # Cache of recent query results, keyed by query embedding
+    query_cache: SemanticCache
+    # Coalesces concurrent chunk queries into batched Chroma calls
+    query_batcher: QueryBatcher
+    # Reads a file's indexed text, memoized by (relative path, file mtime in ns)
+    read_document: Callable[[str, int], str]
+    # Chunk ids of every indexed document, maintained by the embedding worker
+    document_chunks: dict[str, list[str]]
 
 
-@asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-    """Manage application lifecycle with type-safe context."""
-    # Check that directory exists, else create it
-    base_directory = Path(args.directory)
-    base_directory.mkdir(parents=True, exist_ok=True)
+def make_lifespan(base_directory: Path) -> Callable[[FastMCP], AsyncContextManager[AppContext]]:
+    """Create the server lifespan for the given watched directory."""
+    @asynccontextmanager
+    async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+        """Manage application lifecycle with type-safe context."""
+        # Check that directory exists, else create it
+        base_directory.mkdir(parents=True, exist_ok=True)
 
-    # Set up vector DB connection
-    client: ClientAPI = PersistentClient(path=str(base_directory.resolve() /'.chroma'))
-    documents_collection = client.get_or_create_collection("documents")
-    chunks_collection = client.get_or_create_collection("chunks")
+        # Set up vector DB connection
+        client: ClientAPI = PersistentClient(path=str(base_directory.resolve() /'.chroma'))
+        documents_collection = client.get_or_create_collection("documents", metadata=COLLECTION_METADATA)
+        chunks_collection = client.get_or_create_collection("chunks", metadata=COLLECTION_METADATA)
+
+        # Resolve the embedding function once; exact repeats of a query skip the model
+        embedding_function = chunks_collection._embedding_function
+
+        @functools.lru_cache(maxsize=1024)
+        def embed_query(query: str) -> tuple[float, ...]:
+            return tuple(float(x) for x in embedding_function([query])[0])
+
+        # The file mtime is part of the key, so edits invalidate the cache. Errors are not
+        # cached, so files that are not (re-)indexed yet are looked up again next time.
+        @functools.lru_cache(maxsize=128)
+        def read_document(relative_path: str, mtime_ns: int) -> str:
+            result = documents_collection.get(ids=[relative_path], include=['documents', 'metadatas'])
+            if len(result['ids']) == 0 or result['metadatas'][0]['last_modified'] * 1e9 < mtime_ns:
+                raise NotFoundError(f"File {relative_path} is not indexed yet.")
+            return result['documents'][0]
     
-    # Start watchdog for automated embeddings
-    stop_event = asyncio.Event()
-    task = asyncio.create_task(embedding_worker(base_directory, chroma_client=client, stop_event=stop_event))
-    try:
-        # Yield the app context
-        yield AppContext(
-            documents_collection=documents_collection,
-            chunks_collection=chunks_collection,
-            base_directory=base_directory
-        )
-    finally:
-        # Shutdown watchdog service for automated embeddings
-        stop_event.set()
-        task.cancel()
+        # Start watchdog for automated embeddings
+        stop_event = asyncio.Event()
+        document_chunks: dict[str, list[str]] = {}
+        # Cached search results go stale whenever the index changes
+        query_cache = SemanticCache()
+        task = asyncio.create_task(embedding_worker(
+            base_directory, chroma_client=client, stop_event=stop_event, document_chunks=document_chunks,
+            on_change=query_cache.clear,
+        ))
+        query_batcher = QueryBatcher(chunks_collection)
+        batcher_task = asyncio.create_task(query_batcher.run())
         try:
-            await task
-        except asyncio.CancelledError:
-            pass
+            # Yield the app context
+            yield AppContext(
+                documents_collection=documents_collection,
+                chunks_collection=chunks_collection,
+                embed_query=embed_query,
+                query_cache=query_cache,
+                query_batcher=query_batcher,
+                read_document=read_document,
+                document_chunks=document_chunks,
+                base_directory=base_directory
+            )
+        finally:
+            # Shutdown watchdog service for automated embeddings
+            stop_event.set()
+            task.cancel()
+            batcher_task.cancel()
+            for pending_task in (task, batcher_task):
+                try:
+                    await pending_task
+                except asyncio.CancelledError:
+                    pass
 
-# MCP Server objects
-mcp = FastMCP(
-        "LocalFilesystemRAG",
-        instructions="""
-This MCP server is a document retrieval and summarization assistant that automatically syncs with a local directory. It maintains a vector database that continuously watches the configured directory, ensuring the searchable content always reflects the current state of the files. You can use it to semantically search documents, extract content chunks, read full files, and generate summaries - all backed by real-time directory synchronization.""",
-        lifespan=app_lifespan)
-
-@mcp.tool()
-def retrieve_chunks(query: str, n_results=10) -> dict[str, Any]:
-    ctx = get_context()
-    chunks_collection: Collection = ctx.request_context.lifespan_context.chunks_collection
-    result: dict = chunks_collection.query(query_texts=[query], n_results=n_results)
+    return app_lifespan
+
+
+# Filters on at most this many documents are searched exactly instead of via filtered HNSW
+SMALL_FILTER_DOCUMENTS = 3
+# Document filters resolving to more chunk ids than this fall back to a metadata `where` filter
+MAX_ID_FILTER = 1000
+
+
+# Keys of a Chroma query result that are returned to the client
+RESULT_KEYS = ('ids', 'documents', 'metadatas', 'distances')
+
+
+def _empty_query_result() -> dict[str, Any]:
+    return {key: [[]] for key in RESULT_KEYS}
+
+
+def _compact_result(result: dict[str, Any]) -> dict[str, Any]:
+    """Drop unused keys of a query result and turn numpy arrays into lists, so it serializes cheaply."""
+    return {
+        key: [row.tolist() if isinstance(row, np.ndarray) else row for row in result[key]]
+        for key in RESULT_KEYS
+    }
+
+
+def _document_filter(document_chunks: dict[str, list[str]], documents: List[str]) -> dict[str, Any]:
+    """Chroma filter arguments selecting the chunks of `documents`.
+
+    Uses the precomputed chunk ids when every document is indexed, otherwise a metadata filter.
+    """
+    chunk_ids = []
+    for document in documents:
+        document_chunk_ids = document_chunks.get(document)
+        if document_chunk_ids is None or len(chunk_ids) + len(document_chunk_ids) > MAX_ID_FILTER:
+            return {'where': {"document": {"$in": documents}}}
+        chunk_ids.extend(document_chunk_ids)
+    return {'ids': chunk_ids}
+
+
+def _query_candidates(collection: Collection, query_embedding, n_results: int, filters: dict[str, Any]) -> dict[str, Any]:
+    """Exact cosine search over the chunks matching `filters`, shaped like a Chroma query result."""
+    candidates = collection.get(**filters, include=['embeddings', 'documents', 'metadatas'])
+    if len(candidates['ids']) == 0:
+        return _empty_query_result()
+    vectors = np.asarray(candidates['embeddings'], dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    similarities = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+    top = np.argsort(-similarities)[:n_results]
+    return {
+        'ids': [[candidates['ids'][i] for i in top]],
+        'documents': [[candidates['documents'][i] for i in top]],
+        'metadatas': [[candidates['metadatas'][i] for i in top]],
+        'distances': [(1 - similarities[top]).tolist()],
+    }
+
+
+# MCP Server instructions
+INSTRUCTIONS = """
+This MCP server is a document retrieval and summarization assistant that automatically syncs with a local directory. It maintains a vector database that continuously watches the configured directory, ensuring the searchable content always reflects the current state of the files. You can use it to semantically search documents, extract content chunks, read full files, and generate summaries - all backed by real-time directory synchronization."""
+
+async def retrieve_chunks(query: str, n_results=10, documents: Optional[List[str]] = None) -> dict[str, Any]:
+    """Retrieve the chunks most similar to the query, optionally only from the given document paths."""
+    lifespan_context: AppContext = get_context().request_context.lifespan_context
+    chunks_collection = lifespan_context.chunks_collection
+    query_cache = lifespan_context.query_cache
+    # Embedding and vector DB calls block, so they run in worker threads
+    query_embedding = await asyncio.to_thread(lifespan_context.embed_query, query)
+    scope = (n_results, tuple(sorted(documents)) if documents else None)
+    result = query_cache.get(query_embedding, scope=scope)
+    if result is None:
+        if not documents:
+            result = await lifespan_context.query_batcher.query(query_embedding, n_results)
+        else:
+            filters = _document_filter(lifespan_context.document_chunks, documents)
+            if filters.get('ids') == []:
+                result = _empty_query_result()
+            elif len(documents) <= SMALL_FILTER_DOCUMENTS:
+                result = await asyncio.to_thread(
+                    _query_candidates, chunks_collection, query_embedding, n_results, filters
+                )
+            else:
+                result = await asyncio.to_thread(
+                    chunks_collection.query,
+                    query_embeddings=[list(query_embedding)],
+                    n_results=n_results,
+                    **filters,
+                )
+        result = _compact_result(result)
+        query_cache.put(query_embedding, result, scope=scope)
     return result
 
-@mcp.resource(uri='data://list-files')
-def get_embedded_files() -> str:
-    ctx = get_context()
-    documents_collection = ctx.request_context.lifespan_context.documents_collection
-    result = documents_collection.get(include=[])
-    response = ""
-    for file_path in result['ids']:
-        response += f"- {file_path}\n"
-    return response
-
-@mcp.prompt()
+async def batch_retrieve_chunks(queries: List[str], n_results=10) -> list[dict[str, Any]]:
+    """Retrieve chunks for several queries with a single vector DB query. Returns one result per query, in order."""
+    lifespan_context: AppContext = get_context().request_context.lifespan_context
+    chunks_collection = lifespan_context.chunks_collection
+    embed_query = lifespan_context.embed_query
+    query_embeddings = await asyncio.to_thread(lambda: [list(embed_query(query)) for query in queries])
+    if not query_embeddings:
+        return []
+    result = await asyncio.to_thread(chunks_collection.query, query_embeddings=query_embeddings, n_results=n_results)
+    result = _compact_result(result)
+    return [split_query_result(result, i) for i in range(len(queries))]
+
+async def get_embedded_files() -> str:
+    lifespan_context: AppContext = get_context().request_context.lifespan_context
+    documents_collection = lifespan_context.documents_collection
+    result = await asyncio.to_thread(documents_collection.get, include=[])
+    return "".join(f"- {file_path}\n" for file_path in result['ids'])
+
+async def get_file_content(relative_path: str) -> str:
+    """Full text of an embedded file, addressed by its path relative to the watched directory."""
+    lifespan_context: AppContext = get_context().request_context.lifespan_context
+    base_directory = lifespan_context.base_directory.resolve()
+    file_path = (base_directory / relative_path).resolve()
+    # Absolute paths, ".." and symlinks must not reach files outside the watched directory
+    if not file_path.is_relative_to(base_directory):
+        raise NotFoundError(f"File {relative_path} not found.")
+    try:
+        mtime_ns = file_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise NotFoundError(f"File {relative_path} not found.")
+    # Documents are stored under their normalized path, so "./a.txt" and "sub/../a.txt" find "a.txt"
+    document_id = str(file_path.relative_to(base_directory))
+    return await asyncio.to_thread(lifespan_context.read_document, document_id, mtime_ns)
+
 def semantic_search(topic: str) -> str:
     prompt = f"""
 Use the `retrieve_chunks` tool to search for '{topic}'. Use the result of the tool call to give me a list of documents (file path and title) covering that topic.
@@ -86,12 +233,26 @@ Use the `retrieve_chunks` tool to search for '{topic}'. Use the result of the to
     return prompt
 
 
-# CLI argument parsing of directory
-parser = argparse.ArgumentParser(description="Start MCP Server")
-parser.add_argument("--directory", type=str, default="./", help="The base directory to put resources in.")
-args = parser.parse_args()
+def create_server(base_directory: Path) -> FastMCP:
+    """Create the MCP server for the given watched directory."""
+    mcp = FastMCP(
+        "LocalFilesystemRAG",
+        instructions=INSTRUCTIONS,
+        lifespan=make_lifespan(base_directory),
+    )
+    mcp.tool()(retrieve_chunks)
+    mcp.tool()(batch_retrieve_chunks)
+    mcp.resource(uri='data://list-files')(get_embedded_files)
+    mcp.resource(uri='data://files/{relative_path*}')(get_file_content)
+    mcp.prompt()(semantic_search)
+    return mcp
+
 
 if __name__ == "__main__":
-    # Run the MCP server
-    mcp.run()
+    # CLI argument parsing of directory
+    parser = argparse.ArgumentParser(description="Start MCP Server")
+    parser.add_argument("--directory", type=str, default="./", help="The base directory to put resources in.")
+    args = parser.parse_args()
 
+    # Run the MCP server
+    create_server(Path(args.directory)).run()
@@ -1,12 +1,105 @@
 from typing import List, Iterator
+import asyncio
+import atexit
+import functools
 import re
+import threading
+from pathlib import Path
 from urllib.parse import urlparse, parse_qs
 
+import numpy as np
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document
 from youtube_transcript_api import YouTubeTranscriptApi, FetchedTranscript
 import yt_dlp
 
+try:
+    from diskcache import Cache
+except ImportError:
+    Cache = None
+
+
+# Video ID in watch, short (youtu.be) and embed URLs, including watch URLs with v= after other params
+_YT_ID_RE = re.compile(r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/|youtube\.com/watch\?.*v=)([^&\n?#]+)')
+
+
+# Video metadata and transcripts are cached on disk per video ID
+_CACHE_DIR = Path("~/.cache/agent-tutorial/yt-loader").expanduser()
+_CACHE_EXPIRE = 7 * 24 * 60 * 60
+
+
+@functools.lru_cache(maxsize=1)
+def _get_cache():
+    """Return the shared disk cache, or None if diskcache is not installed."""
+    return Cache(str(_CACHE_DIR)) if Cache is not None else None
+
+
+# yt-dlp instances are not documented as thread-safe, so the shared one is used under a lock
+_YDL_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_ydl() -> yt_dlp.YoutubeDL:
+    """Return a process-wide YoutubeDL instance, closed at exit."""
+    ydl = yt_dlp.YoutubeDL({
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False
+    })
+    atexit.register(ydl.close)
+    return ydl
+
+
+@functools.lru_cache(maxsize=1)
+def _get_transcript_api() -> YouTubeTranscriptApi:
+    """Return a process-wide YouTubeTranscriptApi, reusing its HTTP session."""
+    return YouTubeTranscriptApi()
+
+
+def _head(text, n: int = 500) -> str:
+    """First `n` characters of `text`; short strings are returned without copying."""
+    if not text:
+        return ''
+    return text if len(text) <= n else text[:n]
+
+
+@functools.lru_cache(maxsize=256)
+def _extract_info(video_id: str, url: str) -> dict:
+    """Fetch the metadata fields we keep for a video with yt-dlp (cached in memory and on disk)."""
+    cache = _get_cache()
+    info = cache.get(('info', video_id)) if cache is not None else None
+    if info is not None:
+        return info
+    with _YDL_LOCK:
+        info = _get_ydl().extract_info(url, download=False)
+    info = {
+        'title': info.get('title', f'Video {video_id}'),
+        'duration': info.get('duration', 0),
+        'uploader': info.get('uploader', 'Unknown'),
+        'upload_date': info.get('upload_date', ''),
+        'description': _head(info.get('description')),  # Truncate description
+        'view_count': info.get('view_count', 0),
+        'like_count': info.get('like_count', 0),
+        'channel_id': info.get('channel_id', ''),
+        'channel_url': info.get('channel_url', ''),
+    }
+    if cache is not None:
+        cache.set(('info', video_id), info, expire=_CACHE_EXPIRE)
+    return info
+
+
+@functools.lru_cache(maxsize=256)
+def _fetch_transcript(video_id: str, languages: tuple[str, ...] = ('en',)) -> FetchedTranscript:
+    """Fetch a transcript with YouTubeTranscriptApi (cached in memory and on disk)."""
+    cache = _get_cache()
+    transcript = cache.get(('transcript', video_id, languages)) if cache is not None else None
+    if transcript is not None:
+        return transcript
+    transcript = _get_transcript_api().fetch(video_id=video_id, languages=languages)
+    if cache is not None:
+        cache.set(('transcript', video_id, languages), transcript, expire=_CACHE_EXPIRE)
+    return transcript
+
 
 class YouTubeTranscriptLoader(BaseLoader):
     """Load YouTube transcript + metadata and return timestamped chunk Documents.
@@ -32,15 +125,9 @@ class YouTubeTranscriptLoader(BaseLoader):
     def _get_video_id(self, url: str) -> str | None:
         """Extract video ID from YouTube URL."""
         # Handle various YouTube URL formats
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([^&\n?#]+)',
-            r'youtube\.com/watch\?.*v=([^&\n?#]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
+        match = _YT_ID_RE.search(url)
+        if match:
+            return match.group(1)
         
         # Try parsing as query parameter
         try:
@@ -49,7 +136,7 @@ class YouTubeTranscriptLoader(BaseLoader):
                 return parse_qs(parsed.query).get('v', [None])[0]
             elif 'youtu.be' in parsed.netloc:
                 return parsed.path.lstrip('/')
-        except:
+        except (ValueError, AttributeError):
             pass
         
         return None
@@ -63,24 +150,7 @@ class YouTubeTranscriptLoader(BaseLoader):
         }
         
         try:
-            ydl_opts = {
-                'quiet': True, 
-                'no_warnings': True,
-                'extract_flat': False
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url, download=False)
-                metadata.update({
-                    'title': info.get('title', f'Video {self.video_id}'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'upload_date': info.get('upload_date', ''),
-                    'description': info.get('description', '')[:500],  # Truncate description
-                    'view_count': info.get('view_count', 0),
-                    'like_count': info.get('like_count', 0),
-                    'channel_id': info.get('channel_id', ''),
-                    'channel_url': info.get('channel_url', ''),
-                })
+            metadata.update(_extract_info(self.video_id, self.url))
         except Exception as e:
             # Silently fail and use defaults - metadata extraction is not critical
             pass
@@ -91,69 +161,67 @@ class YouTubeTranscriptLoader(BaseLoader):
         """Fetch transcript using YouTubeTranscriptApi."""
         try:
             assert self.video_id
-            transcript = YouTubeTranscriptApi().fetch(video_id=self.video_id)
+            transcript = _fetch_transcript(self.video_id)
             return transcript
         except Exception as e:
             raise Exception(f"Failed to get transcript for video {self.video_id}: {e}")
     
-    def _create_chunks(self, transcript: FetchedTranscript, metadata: dict) -> List[Document]:
-        """Create timestamped chunks from transcript segments."""
-        chunks = []
-        current_chunk = {'text': '', 'start_time': 0, 'end_time': 0}
-
-        for entry in transcript.snippets:
-            entry_start = entry.start
-            entry_duration = entry.duration
-            entry_text = entry.text
-            
-            # Check if we should start a new chunk
-            if (entry_start - current_chunk['start_time'] >= self.chunk_seconds and 
-                current_chunk['text']):
-                chunks.append(current_chunk.copy())
-                current_chunk = {
-                    'text': entry_text,
-                    'start_time': entry_start,
-                    'end_time': entry_start + entry_duration
-                }
+    def _iter_chunks(self, transcript: FetchedTranscript, metadata: dict) -> Iterator[Document]:
+        """Yield timestamped chunk Documents from transcript segments, one chunk at a time."""
+        snippets = transcript.snippets
+        if not snippets:
+            return
+        starts = np.fromiter((entry.start for entry in snippets), dtype=np.float64, count=len(snippets))
+        durations = np.fromiter((entry.duration for entry in snippets), dtype=np.float64, count=len(snippets))
+        texts = [entry.text for entry in snippets]
+        # Chunks only start at snippets with text; empty snippets inside a chunk are kept
+        with_text = np.flatnonzero(np.fromiter((bool(text) for text in texts), dtype=bool, count=len(texts)))
+        if len(with_text) == 0:
+            return
+
+        # A chunk ends before the first later entry at least chunk_seconds after its start.
+        # The running maximum keeps the search array sorted even if snippet starts are not;
+        # it only finds the right entry while no earlier entry already reaches the target.
+        running_max = np.maximum.accumulate(starts)
+        lo, i = int(with_text[0]), 0
+        while lo < len(snippets):
+            start = starts[lo]
+            if running_max[lo] - start < self.chunk_seconds:
+                hi = int(np.searchsorted(running_max, start + self.chunk_seconds, side='left'))
+                # Settle the boundary on the `entry start - chunk start >= chunk_seconds` test itself,
+                # which can differ from the rounded sum above by an ulp
+                while hi > lo + 1 and running_max[hi - 1] - start >= self.chunk_seconds:
+                    hi -= 1
+                while hi < len(snippets) and running_max[hi] - start < self.chunk_seconds:
+                    hi += 1
             else:
-                # Add to current chunk
-                if current_chunk['text']:
-                    current_chunk['text'] += ' ' + entry_text
-                else:
-                    current_chunk['text'] = entry_text
-                    current_chunk['start_time'] = entry_start
-                
-                current_chunk['end_time'] = entry_start + entry_duration
-        
-        # Add the last chunk if it has content
-        if current_chunk['text']:
-            chunks.append(current_chunk)
-        
-        # Convert chunks to Document objects
-        documents = []
-        for i, chunk in enumerate(chunks):
-            start_min = int(chunk['start_time'] // 60)
-            start_sec = int(chunk['start_time'] % 60)
-            end_min = int(chunk['end_time'] // 60)
-            end_sec = int(chunk['end_time'] % 60)
+                later = np.flatnonzero(starts[lo + 1:] - start >= self.chunk_seconds)
+                hi = lo + 1 + int(later[0]) if len(later) else len(snippets)
+            start_time = float(start)
+            end_time = float(starts[hi - 1] + durations[hi - 1])
+            start_min = int(start_time // 60)
+            start_sec = int(start_time % 60)
+            end_min = int(end_time // 60)
+            end_sec = int(end_time % 60)
             
             chunk_metadata = {
                 **metadata,
                 'chunk_index': i,
-                'start_seconds': chunk['start_time'],
-                'end_seconds': chunk['end_time'],
+                'start_seconds': start_time,
+                'end_seconds': end_time,
                 'timestamp': f"{start_min:02d}:{start_sec:02d}",
                 'timestamp_range': f"{start_min:02d}:{start_sec:02d}-{end_min:02d}:{end_sec:02d}",
                 'doc_type': 'youtube',
-                'chunk_duration': chunk['end_time'] - chunk['start_time']
+                'chunk_duration': end_time - start_time
             }
             
-            documents.append(Document(
-                page_content=chunk['text'].strip(),
+            yield Document(
+                page_content=' '.join(texts[lo:hi]).strip(),
                 metadata=chunk_metadata
-            ))
-        
-        return documents
+            )
+            # The next chunk starts at the first entry with text from the boundary on
+            next_index = int(np.searchsorted(with_text, hi))
+            lo, i = (int(with_text[next_index]) if next_index < len(with_text) else len(snippets)), i + 1
     
     def load(self) -> List[Document]:
         """Load YouTube transcript and return timestamped chunk Documents.
@@ -166,12 +234,18 @@ class YouTubeTranscriptLoader(BaseLoader):
         # Get transcript
         transcript = self._get_transcript()
         # Create and return chunked documents
-        return self._create_chunks(transcript, metadata)
+        return list(self._iter_chunks(transcript, metadata))
     
+    async def aload(self) -> List[Document]:
+        """Load like `load`, fetching the metadata and the transcript concurrently."""
+        metadata, transcript = await asyncio.gather(
+            asyncio.to_thread(self._get_video_metadata),
+            asyncio.to_thread(self._get_transcript),
+        )
+        return list(self._iter_chunks(transcript, metadata))
+
     def lazy_load(self) -> Iterator[Document]:
         """Lazy load implementation that yields documents one at a time."""
-        documents = self.load()
-        for doc in documents:
-            yield doc
+        return self._iter_chunks(self._get_transcript(), self._get_video_metadata())
 
 
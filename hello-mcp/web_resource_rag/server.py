@@ -1,13 +1,18 @@
 import argparse
-import uuid
+import asyncio
+import functools
+import hashlib
+import warnings
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, AsyncIterator, List, Literal, Optional
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, List, Literal, Optional
 
 import numpy as np
 from chromadb import PersistentClient
 from chromadb.api import ClientAPI
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
 from documents import PDFDocument, YouTubeVideo
 from fastmcp import FastMCP
 from fastmcp.exceptions import NotFoundError
@@ -15,6 +20,14 @@ from fastmcp.server.dependencies import get_context
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from loaders import YouTubeTranscriptLoader
+from semantic_cache import SemanticCache
+from sqlite_vec_store import SqliteVecCollection
+from tokenizers import Tokenizer
+
+try:
+    import uvloop
+except ImportError:  # not installed, or unsupported platform (Windows)
+    uvloop = None
 
 
 @dataclass
@@ -25,31 +38,209 @@ class AppContext:
     documents_collection: Any
     chunks_collection: Any
     base_directory: Path
-
-
-@asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-    """Manage application lifecycle with type-safe context."""
-    base_directory = Path(args.directory)
-    client: ClientAPI = PersistentClient(path=str(base_directory / "vector_db.chroma"))
-    documents_collection = client.get_or_create_collection("documents")
-    chunks_collection = client.get_or_create_collection("chunks")
-    try:
+    # Embedding function of the chunks collection, used to embed chunks before inserting them
+    embed: Callable[[List[str]], Any]
+    # Embeds a single query string (memoized, read-only result), shared by all search tools
+    embed_query: Callable[[str], np.ndarray]
+    # Results of recent searches, looked up by query embedding; cleared when documents change
+    query_cache: SemanticCache
+    # Token-budgeted splitter, built once per server
+    text_splitter: RecursiveCharacterTextSplitter
+    # Bumped whenever documents are added or deleted; invalidates `doc_list_cache`
+    doc_list_version: int = 0
+    # (version, [(document id, metadata), ...]) of the last document listing
+    doc_list_cache: tuple[int, list[tuple[str, dict]]] | None = None
+
+    def documents_changed(self):
+        """Invalidate everything derived from the collections' contents."""
+        self.doc_list_version += 1
+        self.query_cache.clear()
+
+    def list_document_metadata(self) -> list[tuple[str, dict]]:
+        """(document id, metadata) for every stored document, cached until the documents change."""
+        if self.doc_list_cache is not None and self.doc_list_cache[0] == self.doc_list_version:
+            return self.doc_list_cache[1]
+        version = self.doc_list_version
+        all_documents = self.documents_collection.get(include=["metadatas"])
+        listing = list(zip(all_documents["ids"], all_documents["metadatas"]))
+        self.doc_list_cache = (version, listing)
+        return listing
+
+
+# Cosine distance, with a denser HNSW graph and a wider search than Chroma's defaults
+# (M=16, construction_ef=100, search_ef=10) for better recall on larger corpora
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 100,
+}
+
+
+def _distance_space(collection) -> str:
+    """Distance function of a Chroma collection's index, which is fixed when the collection is created."""
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space")
+    return space or (collection.metadata or {}).get("hnsw:space") or "l2"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_embedding_function() -> DefaultEmbeddingFunction:
+    """Process-wide embedding function, so the model is loaded once for all collections and servers."""
+    return DefaultEmbeddingFunction()
+
+
+# Chunk size in model tokens; the 256-token window also holds the [CLS] and [SEP] tokens
+CHUNK_TOKENS = 256 - 2
+CHUNK_OVERLAP_TOKENS = 32
+# Tokens reserved in every chunk for the "[title] " context prefix added before embedding
+CONTEXT_PREFIX_TOKENS = 24
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tokenizer() -> Tokenizer:
+    """Tokenizer of Chroma's default embedding model (all-MiniLM-L6-v2), which truncates its input at 256
+    WordPiece tokens. Loaded from the model files Chroma downloads, so no other download is needed."""
+    model = ONNXMiniLM_L6_V2()
+    model._download_model_if_not_exists()
+    # A fresh instance's tokenizer; it pads and truncates to the model window, which would hide chunk lengths
+    tokenizer = model.tokenizer
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def _count_tokens(text: str) -> int:
+    return len(_get_tokenizer().encode(text, add_special_tokens=False))
+
+
+def make_lifespan(
+    base_directory: Path, vector_store: Literal["chroma", "sqlite-vec"] = "chroma", int8_embeddings: bool = False
+) -> Callable[[FastMCP], AsyncContextManager[AppContext]]:
+    """Create the server lifespan storing its data in the given directory.
+
+    With `vector_store="sqlite-vec"`, chunks are kept in a sqlite-vec database instead of the Chroma
+    chunks collection, whose contents are imported on first use. `int8_embeddings` creates that
+    database with int8-quantized vectors.
+    """
+    @asynccontextmanager
+    async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+        """Manage application lifecycle with type-safe context."""
         base_directory.mkdir(parents=True, exist_ok=True)
-        yield AppContext(
-            vector_db=client,
-            documents_collection=documents_collection,
-            chunks_collection=chunks_collection,
-            base_directory=base_directory,
+        client: ClientAPI = PersistentClient(path=str(base_directory / "vector_db.chroma"))
+        embedding_function = _get_embedding_function()
+        documents_collection = client.get_or_create_collection(
+            "documents", metadata=COLLECTION_METADATA, embedding_function=embedding_function
+        )
+        chunks_collection = client.get_or_create_collection(
+            "chunks", metadata=COLLECTION_METADATA, embedding_function=embedding_function
+        )
+        chunk_store = None
+        if vector_store == "sqlite-vec":
+            chunk_store = SqliteVecCollection(
+                base_directory / "chunks.sqlite", element_type="int8" if int8_embeddings else "float"
+            )
+            # Migrates the Chroma chunks on first use only; the store records that the import ran
+            await asyncio.to_thread(chunk_store.import_collection, chunks_collection)
+            chunks_collection = chunk_store
+        elif (space := _distance_space(chunks_collection)) != "cosine":
+            # COLLECTION_METADATA only applies to new collections; stores created before keep their metric
+            warnings.warn(
+                f"The chunks collection in {base_directory} uses {space} distances instead of cosine. "
+                "Use --vector-store=sqlite-vec, or delete vector_db.chroma and re-add the documents, to switch."
+            )
+        # Load the tokenizer (and fetch the model files if missing) before the first request
+        await asyncio.to_thread(_get_tokenizer)
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_TOKENS - CONTEXT_PREFIX_TOKENS,
+            chunk_overlap=CHUNK_OVERLAP_TOKENS,
+            length_function=_count_tokens,
         )
-    finally:
-        pass
-
 
-mcp = FastMCP(
-    "OnlineResourceRAG",
-    instructions="""
-This MCP server provides a document management system that allows LLMs to store, search, and retrieve research materials from a vector database. It handles PDFs and YouTube videos by extracting their content, splitting them into chunks, and storing both the full documents and their semantic chunks. The server enables semantic search across documents and their chunks, document listing, and deletion capabilities.
+        # Exact repeats of a query string skip the model; the cached vector is shared, so it is read-only
+        @functools.lru_cache(maxsize=1024)
+        def embed_query(query: str) -> np.ndarray:
+            query_embedding = np.asarray(embedding_function([query])[0], dtype=np.float32)
+            query_embedding.flags.writeable = False
+            return query_embedding
+
+        try:
+            yield AppContext(
+                vector_db=client,
+                documents_collection=documents_collection,
+                chunks_collection=chunks_collection,
+                base_directory=base_directory,
+                embed=embedding_function,
+                embed_query=embed_query,
+                query_cache=SemanticCache(threshold=0.95),
+                text_splitter=text_splitter,
+            )
+        finally:
+            if chunk_store is not None:
+                chunk_store.close()
+
+    return app_lifespan
+
+
+def _context_prefix(title: Optional[str]) -> str:
+    """"[title] " prefix situating a chunk in its document, cut to fit in CONTEXT_PREFIX_TOKENS."""
+    if not title:
+        return ""
+    # The brackets take one token each
+    offsets = _get_tokenizer().encode(title, add_special_tokens=False).offsets
+    if len(offsets) > CONTEXT_PREFIX_TOKENS - 2:
+        title = title[:offsets[CONTEXT_PREFIX_TOKENS - 3][1]]
+    return f"[{title}] "
+
+def _chunk_id(doc_id: str, index: int, text: str) -> str:
+    """Content-addressed chunk id; the length-prefixed document id keeps the fields from running together."""
+    h = hashlib.blake2b(digest_size=16)
+    encoded_id = doc_id.encode()
+    h.update(len(encoded_id).to_bytes(4, "little"))
+    h.update(encoded_id)
+    h.update(index.to_bytes(4, "little"))
+    h.update(text.encode())
+    return h.hexdigest()
+
+
+# Number of chunks passed to the embedding function per call
+EMBED_BATCH_SIZE = 64
+
+
+def _embed_texts(embed: Callable[[List[str]], Any], texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """Embed texts in fixed-size batches into one float32 matrix with L2-normalized rows."""
+    embeddings = None
+    for start in range(0, len(texts), batch_size):
+        batch = np.asarray(embed(texts[start:start + batch_size]), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+        embeddings[start:start + len(batch)] = batch
+    if embeddings is None:
+        return np.empty((0, 0), dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+# search_documents ranks documents by their best chunks among this many hits per requested document
+CHUNK_CANDIDATES_PER_DOCUMENT = 5
+
+
+def _rank_documents(chunk_hits: dict[str, Any], k: int) -> dict[str, Any]:
+    """Group a chunk query result by document, ranking each document by its closest chunk."""
+    best: dict[str, float] = {}
+    for metadata, distance in zip(chunk_hits["metadatas"][0], chunk_hits["distances"][0]):
+        doc_id = metadata["document_id"]
+        if doc_id not in best or distance < best[doc_id]:
+            best[doc_id] = distance
+    ranked = sorted(best.items(), key=lambda item: item[1])[:k]
+    return {
+        "ids": [[doc_id for doc_id, _ in ranked]],
+        "distances": [[distance for _, distance in ranked]],
+    }
+
+
+# MCP Server instructions
+INSTRUCTIONS = """
+This MCP server provides a document management system that allows LLMs to store, search, and retrieve research materials from a vector database. It handles PDFs and YouTube videos by extracting their content, splitting them into chunks, and storing both the full documents and their semantic chunks. The server enables semantic search across documents and their chunks, document listing, and deletion capabilities. Search results report a distance for every match; smaller distances mean more similar content.
 
 The system is designed for research workflows where an LLM needs to:
 - Ingest external documents (PDFs, YouTube transcripts) for later reference
@@ -59,13 +250,10 @@ The system is designed for research workflows where an LLM needs to:
 
 An LLM should use this server when it needs to work with external research materials, maintain a persistent knowledge base across sessions, or perform semantic search across document collections.
 
-              """,
-    lifespan=app_lifespan,
-)
+              """
 
 
-@mcp.tool()
-def add_document(url: str, doc_type: Literal["pdf", "youtube"]) -> str:
+async def add_document(url: str, doc_type: Literal["pdf", "youtube"]) -> str:
     """Adds a PDF or YouTube video document to the vector database by:
     1. Loading the document content using appropriate loader
     2. Splitting into chunks with text splitter
@@ -77,46 +265,61 @@ def add_document(url: str, doc_type: Literal["pdf", "youtube"]) -> str:
     ctx = get_context()
     chunks_collection = ctx.request_context.lifespan_context.chunks_collection
     documents_collection = ctx.request_context.lifespan_context.documents_collection
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    embed = ctx.request_context.lifespan_context.embed
+    text_splitter = ctx.request_context.lifespan_context.text_splitter
     doc_id = url
 
+    # Downloading, parsing, embedding and DB writes block, so they run in worker threads
     if doc_type == "pdf":
         loader = PyPDFLoader(url)
-        documents = loader.load()
+        documents = await asyncio.to_thread(loader.load)
         document = PDFDocument(
             source_url=url, title=documents[0].metadata.get("title", None)
         )
     elif doc_type == "youtube":
         loader = YouTubeTranscriptLoader(url)
-        documents = loader.load()
+        documents = await loader.aload()
         document = YouTubeVideo(title=documents[0].metadata.get("title", None))
 
-    # Insert chunks in vector DB
+    # Insert chunks in vector DB, embedded here so the vectors can be reused for the document
     chunks = text_splitter.split_documents(documents)
-    for chunk in chunks:
-        chunk.metadata["document_id"] = doc_id
-    chunk_ids = [str(uuid.uuid4()) for _ in chunks]
-    chunks_collection.add(
+    texts = [chunk.page_content for chunk in chunks]
+    # Situate each chunk in its document for the embedding only; the stored text stays clean
+    context_prefix = _context_prefix(document.title)
+    embeddings = await asyncio.to_thread(_embed_texts, embed, [context_prefix + text for text in texts])
+    # Content-addressed ids make re-adding the same document an idempotent upsert
+    chunk_ids = [_chunk_id(doc_id, i, text) for i, text in enumerate(texts)]
+    # Drop chunks of an earlier version of the document that the new split no longer produces
+    existing = await asyncio.to_thread(chunks_collection.get, where={"document_id": doc_id}, include=[])
+    stale_ids = list(set(existing["ids"]) - set(chunk_ids))
+    if stale_ids:
+        await asyncio.to_thread(chunks_collection.delete, ids=stale_ids)
+    await asyncio.to_thread(
+        chunks_collection.upsert,
         ids=chunk_ids,
-        documents=[chunk.page_content for chunk in chunks],
-        metadatas=[chunk.metadata for chunk in chunks],
+        documents=texts,
+        metadatas=[{**chunk.metadata, "document_id": doc_id} for chunk in chunks],
+        embeddings=embeddings,
     )
 
     # Insert document in vector DB
-    results = chunks_collection.get(ids=chunk_ids, include=["embeddings"])
-    embeddings = results["embeddings"]
-    document_embedding = np.average(embeddings, axis=0)
-    document_full_text = " ".join([page.page_content for page in documents])
-    documents_collection.add(
+    document_embedding = embeddings.mean(axis=0)
+    # str.join sizes the result once; single-page documents need no copy at all
+    if len(documents) == 1:
+        document_full_text = documents[0].page_content
+    else:
+        document_full_text = " ".join([page.page_content for page in documents])
+    await asyncio.to_thread(
+        documents_collection.upsert,
         ids=[doc_id],
-        embeddings=[document_embedding],
+        embeddings=document_embedding[None, :],
         documents=[document_full_text],
         metadatas=[document.model_dump(mode="json", exclude_none=True)],
     )
+    ctx.request_context.lifespan_context.documents_changed()
     return f"Added document {doc_id} and {len(chunks)} chunks to the vector database."
 
 
-@mcp.tool()
 def search_documents(query: str, k: int = 10) -> dict:
     """Searches documents in the vector database using a query string.
 
@@ -131,13 +334,22 @@ def search_documents(query: str, k: int = 10) -> dict:
         A dictionary containing document IDs and metadata for the top matches.
     """
     ctx = get_context()
-    results = ctx.request_context.lifespan_context.documents_collection.query(
-        query_texts=[query], n_results=k, include=["distances"]
-    )
+    query_cache = ctx.request_context.lifespan_context.query_cache
+    query_embedding = ctx.request_context.lifespan_context.embed_query(query)
+    scope = ("documents", k)
+    results = query_cache.get(query_embedding, scope=scope)
+    if results is None:
+        # Documents are ranked by their closest chunk rather than by a mean-pooled document vector
+        chunk_hits = ctx.request_context.lifespan_context.chunks_collection.query(
+            query_embeddings=[query_embedding],
+            n_results=k * CHUNK_CANDIDATES_PER_DOCUMENT,
+            include=["distances", "metadatas"],
+        )
+        results = _rank_documents(chunk_hits, k)
+        query_cache.put(query_embedding, results, scope=scope)
     return results
 
 
-@mcp.tool()
 def retrieve_chunks(
     query: str, k: int = 15, document_ids: Optional[List[str]] = None
 ) -> dict[str, Any]:
@@ -161,20 +373,26 @@ def retrieve_chunks(
             - 'distances': List of similarity scores/distances for each result
     """
     ctx = get_context()
+    query_cache = ctx.request_context.lifespan_context.query_cache
+    query_embedding = ctx.request_context.lifespan_context.embed_query(query)
+    scope = ("chunks", k, tuple(sorted(document_ids)) if document_ids else None)
+    results = query_cache.get(query_embedding, scope=scope)
+    if results is not None:
+        return results
     if document_ids:
         results = ctx.request_context.lifespan_context.chunks_collection.query(
-            query_texts=[query],
+            query_embeddings=[query_embedding],
             n_results=k,
             where={"document_id": {"$in": document_ids}},
         )
     else:
         results = ctx.request_context.lifespan_context.chunks_collection.query(
-            query_texts=[query], n_results=k
+            query_embeddings=[query_embedding], n_results=k
         )
+    query_cache.put(query_embedding, results, scope=scope)
     return results
 
 
-@mcp.tool()
 def delete_documents(doc_keys: List[str]) -> str:
     """Delete documents and their associated chunks by document keys/IDs.
 
@@ -191,14 +409,14 @@ def delete_documents(doc_keys: List[str]) -> str:
     doc_collection = ctx.request_context.lifespan_context.documents_collection
     chunk_collection = ctx.request_context.lifespan_context.chunks_collection
 
-    for doc_key in doc_keys:
-        doc_collection.delete(ids=[doc_key])
-        chunk_collection.delete(where={"document_id": doc_key})
+    if doc_keys:
+        doc_collection.delete(ids=doc_keys)
+        chunk_collection.delete(where={"document_id": {"$in": doc_keys}})
+    ctx.request_context.lifespan_context.documents_changed()
 
     return f"Deleted documents {doc_keys}"
 
 
-@mcp.tool()
 def list_documents() -> list[dict[str, Any]]:
     """List all documents in the documents collection with their titles and sources.
 
@@ -211,16 +429,13 @@ def list_documents() -> list[dict[str, Any]]:
         A list of dictionaries representing documents with their metadata
     """
     ctx = get_context()
-    documents_collection = ctx.request_context.lifespan_context.documents_collection
-    all_documents = documents_collection.get(include=["metadatas"])
     documents = [
         {"title": metadata.get("title", None), "source": doc_id}
-        for doc_id, metadata in zip(all_documents["ids"], all_documents["metadatas"])
+        for doc_id, metadata in ctx.request_context.lifespan_context.list_document_metadata()
     ]
     return documents
 
 
-@mcp.tool()
 def get_full_text(document_url: str) -> str:
     ctx = get_context()
     documents_collection = ctx.request_context.lifespan_context.documents_collection
@@ -233,19 +448,14 @@ def get_full_text(document_url: str) -> str:
         raise NotFoundError(f"File {document_url} not found.")
 
 
-@mcp.resource("data://all_resources")
 def list_all_resources() -> str:
     ctx = get_context()
-    documents_collection = ctx.request_context.lifespan_context.documents_collection
-    all_documents = documents_collection.get(include=["metadatas"])
-    response = ""
-    for doc_id, metadata in zip(all_documents["ids"], all_documents["metadatas"]):
-        title = metadata.get("title", "N/A")
-        response += f"- <{doc_id}>: {title}\n"
-    return response
+    return "".join(
+        f"- <{doc_id}>: {metadata.get('title', 'N/A')}\n"
+        for doc_id, metadata in ctx.request_context.lifespan_context.list_document_metadata()
+    )
 
 
-@mcp.resource("https://{path*}")
 def get_resource(path: str) -> str:
     ctx = get_context()
     documents_collection = ctx.request_context.lifespan_context.documents_collection
@@ -257,7 +467,6 @@ def get_resource(path: str) -> str:
         raise NotFoundError(f"File {url} not found.")
 
 
-@mcp.prompt()
 def summarize(url: str) -> str:
     """
     A summarization prompt to get well-written summaries.
@@ -280,7 +489,6 @@ Please summarize it according to these rules:
     return prompt
 
 
-@mcp.prompt()
 def generate_transcript(research_topic: str, expert_persona: str = "") -> str:
     """Generate a podcast interview transcript based on a research topic."""
     if expert_persona:
@@ -318,7 +526,6 @@ def generate_transcript(research_topic: str, expert_persona: str = "") -> str:
     """
 
 
-@mcp.prompt()
 def generate_research_questions(research_topic: str, goals: str | None = None) -> str:
     listed_goals = ""
     if goals:
@@ -353,14 +560,53 @@ def generate_research_questions(research_topic: str, goals: str | None = None) -
     """
 
 
-parser = argparse.ArgumentParser(description="Start MCP Server")
-parser.add_argument(
-    "--directory",
-    type=str,
-    default="./research_mcp_server_directory",
-    help="The base directory to put resources in.",
-)
-args = parser.parse_args()
+def create_server(
+    base_directory: Path, vector_store: Literal["chroma", "sqlite-vec"] = "chroma", int8_embeddings: bool = False
+) -> FastMCP:
+    """Create the MCP server storing its data in the given directory."""
+    mcp = FastMCP(
+        "OnlineResourceRAG",
+        instructions=INSTRUCTIONS,
+        lifespan=make_lifespan(base_directory, vector_store, int8_embeddings),
+    )
+    mcp.tool()(add_document)
+    mcp.tool()(search_documents)
+    mcp.tool()(retrieve_chunks)
+    mcp.tool()(delete_documents)
+    mcp.tool()(list_documents)
+    mcp.tool()(get_full_text)
+    mcp.resource("data://all_resources")(list_all_resources)
+    mcp.resource("https://{path*}")(get_resource)
+    mcp.prompt()(summarize)
+    mcp.prompt()(generate_transcript)
+    mcp.prompt()(generate_research_questions)
+    return mcp
+
 
 if __name__ == "__main__":
-    mcp.run()
+    parser = argparse.ArgumentParser(description="Start MCP Server")
+    parser.add_argument(
+        "--directory",
+        type=str,
+        default="./research_mcp_server_directory",
+        help="The base directory to put resources in.",
+    )
+    parser.add_argument(
+        "--vector-store",
+        choices=["chroma", "sqlite-vec"],
+        default="chroma",
+        help="Where chunk embeddings are stored and searched.",
+    )
+    parser.add_argument(
+        "--int8-embeddings",
+        action="store_true",
+        help="Store chunk embeddings quantized to int8 (new sqlite-vec stores only).",
+    )
+    args = parser.parse_args()
+    if args.int8_embeddings and args.vector_store != "sqlite-vec":
+        parser.error("--int8-embeddings requires --vector-store sqlite-vec")
+
+    # Use the libuv event loop when available; uvloop.install() is deprecated on Python 3.12+
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    create_server(Path(args.directory), args.vector_store, args.int8_embeddings).run()
@@ -0,0 +1,250 @@
+"""
+Chunk store on SQLite with the sqlite-vec extension, usable in place of a Chroma collection.
+Implements the subset of the Chroma collection API the server uses: `upsert`, `get`, `query`, `delete` and `count`.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Literal, Optional, Sequence
+
+import numpy as np
+
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+
+
+# Metadata keys are inlined into SQL, so only plain identifiers are accepted
+_KEY_RE = re.compile(r"^\w+$")
+_VECTOR_COLUMN_RE = re.compile(r"(float|int8)\[(\d+)\]")
+
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    """Symmetric int8 quantization with a per-vector max-abs scale.
+
+    The scale is not stored: cosine distance ignores each vector's length, so only the direction matters.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scale = np.maximum(np.abs(vectors).max(axis=1, keepdims=True), 1e-12) / 127
+    return np.rint(vectors / scale).astype(np.int8)
+
+
+def _where_sql(where: Optional[dict]) -> tuple[str, list]:
+    """Translate a Chroma `where` filter made of equality and `$in` conditions into SQL."""
+    clauses, params = [], []
+    for key, condition in (where or {}).items():
+        if not _KEY_RE.match(key):
+            raise ValueError(f"Unsupported metadata key in where filter: {key!r}")
+        column = f"json_extract(c.metadata, '$.{key}')"
+        if isinstance(condition, dict):
+            if set(condition) != {"$in"}:
+                raise ValueError(f"Unsupported where operators: {sorted(condition)}")
+            values = list(condition["$in"])
+            if not values:
+                clauses.append("0")
+                continue
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        else:
+            clauses.append(f"{column} = ?")
+            params.append(condition)
+    return " AND ".join(clauses) or "1", params
+
+
+class SqliteVecCollection:
+    """Chunks in a SQLite table, with their vectors in a sqlite-vec `vec0` table sharing the rowid."""
+
+    def __init__(self, path: Path | str, element_type: Literal["float", "int8"] = "float"):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: SQLite database file
+            element_type: Vector storage for a new store; "int8" quantizes embeddings to a quarter of the size.
+                An existing store keeps the type it was created with.
+        """
+        if sqlite_vec is None:
+            raise ImportError("The sqlite-vec vector store requires the `sqlite-vec` package.")
+        # Tools call the store from worker threads; the lock serializes use of the connection
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.enable_load_extension(True)
+        sqlite_vec.load(self._db)
+        self._db.enable_load_extension(False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks "
+                "(rowid INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+            )
+            # Store-level flags, e.g. whether the one-time import from Chroma has run
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (json_extract(metadata, '$.document_id'))"
+            )
+            row = self._db.execute("SELECT sql FROM sqlite_master WHERE name = 'vec_chunks'").fetchone()
+        # The vector table is created on the first insert, once the dimensionality is known
+        self._dim: Optional[int] = None
+        self.element_type = element_type
+        if row is not None:
+            match = _VECTOR_COLUMN_RE.search(row[0])
+            self.element_type, self._dim = match.group(1), int(match.group(2))
+        # SQL expression for a vector parameter, matching the column's element type
+        self._vector_sql = "vec_int8(?)" if self.element_type == "int8" else "?"
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Vectors as rows in the storage element type; each row's bytes are a vector parameter."""
+        if self.element_type == "int8":
+            return quantize_int8(vectors)
+        return np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def upsert(self, ids: Sequence[str], embeddings, documents: Optional[Sequence[str]] = None,
+               metadatas: Optional[Sequence[dict]] = None):
+        """Insert chunks, replacing those whose id already exists."""
+        with self._lock, self._db:
+            self._upsert_locked(ids, embeddings, documents, metadatas)
+
+    def _upsert_locked(self, ids, embeddings, documents, metadatas):
+        """Upsert inside the caller's transaction (caller holds the lock)."""
+        if len(ids) == 0:
+            return
+        vectors = self._encode(embeddings)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        if self._dim is None:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE vec_chunks USING "
+                f"vec0(embedding {self.element_type}[{vectors.shape[1]}] distance_metric=cosine)"
+            )
+            self._dim = vectors.shape[1]
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({self._dim}).")
+        for chunk_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+            (rowid,) = self._db.execute(
+                "INSERT INTO chunks (id, document, metadata) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET document = excluded.document, metadata = excluded.metadata "
+                "RETURNING rowid",
+                (chunk_id, document, json.dumps(metadata) if metadata is not None else None),
+            ).fetchone()
+            # vec0 tables do not support upserts
+            self._db.execute("DELETE FROM vec_chunks WHERE rowid = ?", (rowid,))
+            self._db.execute(
+                f"INSERT INTO vec_chunks (rowid, embedding) VALUES (?, {self._vector_sql})", (rowid, vector.tobytes())
+            )
+
+    def _select(self, columns: str, ids: Optional[Sequence[str]], where: Optional[dict], with_vectors: bool = False,
+                limit: Optional[int] = None, offset: Optional[int] = None) -> list[tuple]:
+        """Rows of `columns` for the chunks matching `ids` and `where`, in insertion order."""
+        sql, params = _where_sql(where)
+        if ids is not None:
+            if len(ids) == 0:
+                return []
+            sql += f" AND c.id IN ({', '.join('?' * len(ids))})"
+            params.extend(ids)
+        join = " JOIN vec_chunks v ON v.rowid = c.rowid" if with_vectors else ""
+        sql = f"SELECT {columns} FROM chunks c{join} WHERE {sql} ORDER BY c.rowid"
+        if limit is not None or offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset or 0])
+        return self._db.execute(sql, params).fetchall()
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None,
+            include: Sequence[str] = ("documents", "metadatas"), limit: Optional[int] = None,
+            offset: Optional[int] = None) -> dict[str, Any]:
+        """Return the chunks matching `ids` and/or `where`, shaped like `Collection.get`."""
+        with self._lock:
+            if "embeddings" in include and self._dim is not None:
+                rows = self._select("c.id, c.document, c.metadata, v.embedding", ids, where, True, limit, offset)
+            else:
+                rows = self._select("c.id, c.document, c.metadata, NULL", ids, where, False, limit, offset)
+        result: dict[str, Any] = {"ids": [row[0] for row in rows], "included": list(include)}
+        result["documents"] = [row[1] for row in rows] if "documents" in include else None
+        result["metadatas"] = [json.loads(row[2]) if row[2] else None for row in rows] if "metadatas" in include else None
+        if "embeddings" in include:
+            dtype = np.int8 if self.element_type == "int8" else np.float32
+            embeddings = np.array(
+                [np.frombuffer(row[3], dtype=dtype) for row in rows], dtype=np.float32
+            ).reshape(len(rows), self._dim or 0)
+            if self.element_type == "int8":
+                # Quantized vectors lost their length; return unit vectors in their direction
+                embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            result["embeddings"] = embeddings
+        else:
+            result["embeddings"] = None
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Sequence[str] = ("documents", "metadatas", "distances")) -> dict[str, Any]:
+        """Nearest chunks by cosine distance for each query embedding, shaped like `Collection.query`.
+
+        Unfiltered queries use the vec0 KNN index; filtered ones scan the matching chunks exactly.
+        """
+        where_sql, where_params = _where_sql(where)
+        result: dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            for query_vector in (self._encode(query_embeddings) if self._dim is not None else query_embeddings):
+                if self._dim is None:
+                    rows = []
+                elif where is None:
+                    rows = self._db.execute(
+                        "SELECT c.id, c.document, c.metadata, knn.distance "
+                        f"FROM (SELECT rowid, distance FROM vec_chunks WHERE embedding MATCH {self._vector_sql} AND k = ?) knn "
+                        "JOIN chunks c ON c.rowid = knn.rowid ORDER BY knn.distance",
+                        (query_vector.tobytes(), n_results),
+                    ).fetchall()
+                else:
+                    rows = self._db.execute(
+                        f"SELECT c.id, c.document, c.metadata, vec_distance_cosine(v.embedding, {self._vector_sql}) AS distance "
+                        f"FROM chunks c JOIN vec_chunks v ON v.rowid = c.rowid WHERE {where_sql} "
+                        "ORDER BY distance LIMIT ?",
+                        [query_vector.tobytes(), *where_params, n_results],
+                    ).fetchall()
+                result["ids"].append([row[0] for row in rows])
+                result["documents"].append([row[1] for row in rows])
+                result["metadatas"].append([json.loads(row[2]) if row[2] else None for row in rows])
+                result["distances"].append([row[3] for row in rows])
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                result[key] = None
+        result["embeddings"] = None
+        result["included"] = list(include)
+        return result
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None):
+        """Delete the chunks matching `ids` and/or `where`."""
+        if ids is None and where is None:
+            raise ValueError("delete() needs ids or a where filter.")
+        with self._lock, self._db:
+            rowids = [(rowid,) for (rowid,) in self._select("c.rowid", ids, where)]
+            if self._dim is not None:
+                self._db.executemany("DELETE FROM vec_chunks WHERE rowid = ?", rowids)
+            self._db.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+
+    def import_collection(self, collection, batch_size: int = 1024) -> bool:
+        """Copy every record of a Chroma collection into this store, once per store.
+
+        The copy and the record that it ran commit in one transaction, so an interrupted import is
+        redone from scratch, and later calls (e.g. after all chunks were deleted) do not bring back
+        records from the source collection. Returns whether records were imported.
+        """
+        with self._lock, self._db:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'chroma_imported'").fetchone() is not None:
+                return False
+            for offset in range(0, collection.count(), batch_size):
+                batch = collection.get(
+                    include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+                )
+                self._upsert_locked(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+            self._db.execute("INSERT INTO meta (key, value) VALUES ('chroma_imported', '1')")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._db.close()